@@ -1,5 +1,6 @@
 import os
 import io
+import hashlib
 import random
 import string
 import streamlit as st
@@ -8,6 +9,17 @@ import numpy as np
 from datetime import datetime, date, timedelta
 from PIL import Image, ImageDraw, ImageFont
 import altair as alt
+from persona_io import PERSONA_NAME_COLUMNS, load_persona_catalog, resolve_persona_sources
+from shopper_ingest import (
+    collect_profile_job, profile_cache_clear, profile_cache_stats, profile_job_status, submit_profile_job,
+)
+from pricing import (
+    CHANNELS_8, GOALS, GOAL_TEMPLATES, INDUSTRIES, LEGACY_CH_MAP,
+    MC_CPA_CV, MC_CTR_CV, MC_SCENARIOS,
+    active_rate_card, active_response_curves, affinity_matrix, channel_slot_mask, dedup_audience,
+    flight_rate_tables, flight_rates, optimize_mix, pricing_memo_stats, proposal_summary,
+    reach_frequency, sensitivity_grid, simulate_mix_kpis,
+)
 
 APP_NAME = "HAPPYGO CRM+"
 SLOGAN = "我們最懂您的客戶與幫助您成長。"
@@ -27,9 +39,13 @@ def init_state():
     # 注意：這裡沿用舊鍵值，稍後在 M3 會做正規化，因此不會再觸發 multiselect 例外
     ss.setdefault("channel_mix", {"FB_動態":35, "IG_限時":25, "Google_搜尋":25, "YouTube_展示":15})
     ss.setdefault("persona_df", None)
+    ss.setdefault("persona_fp", None)
     ss.setdefault("selected_ta", [])
     ss.setdefault("selected_ta_sizes", {})
     ss.setdefault("insight_from_upload", None)
+    ss.setdefault("m13_job", None)
+    ss.setdefault("m13_result", None)
+    ss.setdefault("m13_upload_nonce", 0)
     # AI panels
     ss.setdefault("show_ai_m11", False)
     ss.setdefault("chat_m11", [])
@@ -37,6 +53,7 @@ def init_state():
     ss.setdefault("chat_m12", [])
     # TA 頁：展開更多
     ss.setdefault("m2_expand_more", False)
+    ss.setdefault("m2_page", 1)
     # M3 渠道模板（8 渠道，依目標帶預設）
     ss.setdefault("m3_channel_weights", None)
 
@@ -45,31 +62,74 @@ def gen_order_code():
     suf = "".join(random.choices(string.ascii_uppercase + string.digits, k=4))
     return f"ORDER-{ts}-{suf}"
 
-def try_load_persona_default():
-    p = os.path.join(".", "Persona_虛擬消費者_202508.xlsx")
-    if os.path.exists(p):
-        try:
-            df = pd.read_excel(p, engine="openpyxl")
-            return df
-        except Exception:
-            return None
-    return None
+PERSONA_DEFAULT_PATH = os.path.join(".", "Persona_虛擬消費者_202508.xlsx")
+# 多客戶 / 多季度：有 manifest 用 manifest，否則讀 personas/ 下所有 xlsx，都沒有才用預設檔
+PERSONA_MANIFEST_PATH = os.path.join(".", "persona_catalog.json")
+PERSONA_DIR = os.path.join(".", "personas")
+
+PERSONA_SAMPLE = {
+    "Persona":["年輕都會女性","注重健康上班族","有毛孩家庭","健身重訓者","理性比價族","追劇社交族","品味居家族","通勤族","潮流美妝迷","銀髮熟齡族"],
+    "規模":[180000,220000,130000,90000,160000,140000,80000,150000,110000,70000],
+    "痛點":["時間不夠","健康+時間管理","用品選擇多","訓練效率","價格敏感","資訊過載","質感與收納","移動時間長","妝容持久度","操作便利"],
+    "推薦版位":["IG/FB","Google/FB","FB/IG","IG/YouTube","Google/FB","FB","IG/FB","APP/Push","IG/EDM","EDM/LINE"],
+    "關鍵字":["美妝 輕奢 新品","保健 營養 上班族","寵物 飼料 清潔","健身 補劑 重訓","比價 折扣 促銷","口碑 社群 推薦","家居 風格 收納","通勤 便利 小巧","底妝 持妝 防水","簡單 大字 清楚"]
+}
 
-def ensure_persona_loaded():
+def persona_file_stamp(path=PERSONA_DEFAULT_PATH):
+    """回傳 (絕對路徑, mtime_ns, size) 作為檔案指紋；檔案不存在則回傳 None。"""
+    try:
+        stt = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.abspath(path), stt.st_mtime_ns, stt.st_size)
+
+def persona_catalog_stamp():
+    """Persona 目錄所有來源檔（含 manifest）的 (路徑, sheets, mtime_ns, size)；沒有任何來源時回傳 None。"""
+    sources = resolve_persona_sources(PERSONA_MANIFEST_PATH, PERSONA_DIR, PERSONA_DEFAULT_PATH)
+    stamp = []
+    for path, sheets in sources:
+        fs = persona_file_stamp(path)
+        if fs is not None:
+            stamp.append((fs[0], sheets) + fs[1:])
+    if not stamp:
+        return None
+    return (persona_file_stamp(PERSONA_MANIFEST_PATH),) + tuple(stamp)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _load_persona_catalog(stamp):
+    # 以所有來源檔的指紋為鍵，整個 server process 共用同一份；任一檔案被替換時指紋改變即自動重載。
+    # 回傳的 DataFrame 為所有 session 共用，請勿就地修改。
+    try:
+        return load_persona_catalog([(path, sheets) for path, sheets, _, _ in stamp[1:]])
+    except Exception:
+        return None
+
+@st.cache_resource(show_spinner=False)
+def _persona_sample_catalog():
+    return pd.DataFrame(PERSONA_SAMPLE)
+
+def try_load_persona_default(stamp):
+    if stamp is None:
+        return None, None
+    df = _load_persona_catalog(stamp)
+    if df is None:
+        return None, None
+    return df, stamp
+
+def ensure_persona_loaded(stamp):
+    """讓 session 持有共用 Persona 目錄的參照（不複製）；檔案更新時自動換成新版本。
+
+    stamp 為 persona_catalog_stamp() 的結果，由 main 每次 rerun 算一次後傳入；
+    各 helper 直接用 session 中的 persona_df / persona_fp，不再各自 listdir / stat。
+    """
     ss = st.session_state
-    if ss.get("persona_df") is None:
-        df = try_load_persona_default()
-        if df is not None:
-            ss["persona_df"] = df
-        else:
-            # fallback sample
-            ss["persona_df"] = pd.DataFrame({
-                "Persona":["年輕都會女性","注重健康上班族","有毛孩家庭","健身重訓者","理性比價族","追劇社交族","品味居家族","通勤族","潮流美妝迷","銀髮熟齡族"],
-                "規模":[180000,220000,130000,90000,160000,140000,80000,150000,110000,70000],
-                "痛點":["時間不夠","健康+時間管理","用品選擇多","訓練效率","價格敏感","資訊過載","質感與收納","移動時間長","妝容持久度","操作便利"],
-                "推薦版位":["IG/FB","Google/FB","FB/IG","IG/YouTube","Google/FB","FB","IG/FB","APP/Push","IG/EDM","EDM/LINE"],
-                "關鍵字":["美妝 輕奢 新品","保健 營養 上班族","寵物 飼料 清潔","健身 補劑 重訓","比價 折扣 促銷","口碑 社群 推薦","家居 風格 收納","通勤 便利 小巧","底妝 持妝 防水","簡單 大字 清楚"]
-            })
+    df, stamp = try_load_persona_default(stamp)
+    if df is None:
+        # fallback sample
+        df, stamp = _persona_sample_catalog(), ("sample",)
+    if ss.get("persona_fp") != stamp or ss.get("persona_df") is None:
+        ss["persona_df"] = df
+        ss["persona_fp"] = stamp
 
 def sidebar_brand():
     ss = st.session_state
@@ -145,57 +205,8 @@ def page_header(title, extra_tag=None):
     else:
         st.caption(crumbs)
 
-# ---------- Helper: KPI & Pricing (簡化估算 for M1) ----------
-
-UNIT_CTR = {"FB":1.2,"Google":2.2,"Line":1.0,"SMS":0.8,"EDM":1.0,"APP廣告":1.1,"APP任務":0.9,"APP Push":1.3}
-UNIT_CPA = {"FB":140,"Google":110,"Line":160,"SMS":180,"EDM":170,"APP廣告":150,"APP任務":190,"APP Push":160}
-
-DAY_RATE = {
-    "FB":28000, "Google":32000, "Line":22000, "SMS":15000,
-    "EDM":18000, "APP廣告":26000, "APP任務":20000, "APP Push":17000
-}
-
-def estimate_by_mix(budget, mix):
-    if not mix or sum(mix.values()) == 0:
-        return {"CTR":0,"CPA":0,"轉換":0,"ROAS":0,"成本":0}
-    w = {k:v/sum(mix.values()) for k,v in mix.items()}
-    ctr = sum(UNIT_CTR.get(k,1.0)*w[k] for k in w)
-    cpa = sum(UNIT_CPA.get(k,150)*w[k] for k in w)
-    cost = budget
-    conv = int(max(cost/cpa, 0))
-    roas = round((conv*300)/cost, 2) if cost>0 else 0
-    return {"CTR":round(ctr,2), "CPA":round(cpa,2), "轉換":conv, "ROAS":roas, "成本":cost}
-
-def quote_by_days_and_mix(days, mix, day_rate=None):
-    if day_rate is None:
-        day_rate = DAY_RATE
-    if not mix or sum(mix.values()) == 0:
-        return 0, {}
-    breakdown = {}
-    for ch, pct in mix.items():
-        r = day_rate.get(ch, 20000)
-        breakdown[ch] = round(days * r * (pct/100))
-    return int(sum(breakdown.values())), breakdown
-
-# ---------- GOAL-based channel templates (for M3) ----------
-
-CHANNELS_8 = ["FB","Google","Line","SMS","EDM","APP廣告","APP任務","APP Push"]
-
-GOAL_TEMPLATES = {
-    "曝光": {"FB":25,"Google":25,"APP廣告":20,"APP Push":10,"Line":10,"EDM":5,"SMS":3,"APP任務":2},
-    "名單": {"Google":30,"FB":25,"EDM":15,"Line":10,"SMS":10,"APP任務":5,"APP Push":3,"APP廣告":2},
-    "購買": {"Google":35,"FB":20,"EDM":15,"Line":10,"APP Push":8,"SMS":5,"APP廣告":5,"APP任務":2},
-}
-
 # ---------- Normalize (legacy -> canonical channels) ----------
 
-LEGACY_CH_MAP = {
-    "FB_動態": "FB",
-    "IG_限時": "FB",           # IG 歸入 FB 類型
-    "Google_搜尋": "Google",
-    "YouTube_展示": "Google",   # YouTube 歸入 Google 類型
-}
-
 def normalize_channel_weights(weights: dict) -> dict:
     """
     將任意渠道鍵（包含舊版：FB_動態、IG_限時、Google_搜尋、YouTube_展示）
@@ -251,6 +262,125 @@ def page_login():
 
 # ---------- Module 1：提案目標與報價 ----------
 
+@st.cache_data(max_entries=512, show_spinner=False)
+def _mix_kpi_bands(budget, mix_items, days, ctr_items=(), cpa_items=(), industry=None, curves_version=None):
+    # 以 (預算, 排序後的配比, 天數, 檔期費率, 產業, 曲線版本) 為鍵；滑桿拉回先前的值時直接命中
+    return simulate_mix_kpis(budget, dict(mix_items), days, unit_ctr=dict(ctr_items), unit_cpa=dict(cpa_items),
+                             curves=active_response_curves(), industry=industry)
+
+WHAT_IF_BUDGET_STEPS = 50
+WHAT_IF_DAYS = 60
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _what_if_grid(mix_items, base_budget, start, industry, card_version, curves_version=None):
+    # 只在配比、預算基準、開始日、費率表或曲線版本改變時重算；網格為預算基準的 0.2–3 倍 × 1–60 天
+    mix = dict(mix_items)
+    card = active_rate_card()
+    day_counts = np.arange(1, WHAT_IF_DAYS + 1)
+    rates = flight_rates(card, np.repeat(np.datetime64(start, "D"), len(day_counts)), day_counts, industry, list(mix))
+    budgets = np.linspace(base_budget * 0.2, base_budget * 3, WHAT_IF_BUDGET_STEPS).round(-3)
+    # 查不到費率的渠道不計入報價與轉換（與摘要一致，NaN 直接交給 batch_quote 排除），CTR/CPA 取開始日那天的費率
+    ctr = {ch: v for ch, v in zip(mix, rates["ctr"][0]) if not np.isnan(v)}
+    cpa = {ch: v for ch, v in zip(mix, rates["cpa"][0]) if not np.isnan(v)}
+    return sensitivity_grid(mix, budgets, day_counts, rates["day_rate"], ctr, cpa,
+                            curves=active_response_curves(), industry=industry)
+
+def _m11_apply_mix(mix):
+    # 清掉滑桿狀態，讓它們依新的 channel_mix 重新帶入預設值
+    st.session_state["channel_mix"] = dict(mix)
+    for ch in CHANNELS_8:
+        st.session_state.pop(f"m11_mix_{ch}", None)
+
+# 部分重跑：Streamlit 1.37 起為 st.fragment，1.36 為 st.experimental_fragment；都沒有時退回整頁重跑
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+
+def _fragment_every(seconds):
+    # 定時自動重跑的 fragment（用於輪詢背景工作）；沒有 fragment 時不自動更新，等下一次互動重跑
+    frag = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    return frag(run_every=seconds) if frag else (lambda f: f)
+
+@_fragment
+def _m11_mix_and_summary():
+    """渠道配比滑桿 + 提案摘要；包在 fragment 裡，拉動滑桿只重跑這一段，不重跑側欄與其他分頁。"""
+    st.subheader("渠道配比（可調整，將連動報價）")
+    goal_for_mix = st.session_state.get("m11_goal","曝光")
+    raw_mix = st.session_state.get("channel_mix") or GOAL_TEMPLATES.get(goal_for_mix, GOAL_TEMPLATES["曝光"]).copy()
+    # 舊版渠道鍵（FB_動態…）併入標準渠道，否則它們會以費率表查不到的渠道留在配比裡
+    default_mix = {ch: 0 for ch in CHANNELS_8}
+    for k, v in raw_mix.items():
+        key = LEGACY_CH_MAP.get(k, k)
+        default_mix[key] = default_mix.get(key, 0) + int(v)
+    mix = default_mix
+    cols = st.columns(4)
+    for idx, ch in enumerate(CHANNELS_8):
+        mix[ch] = cols[idx % 4].slider(ch, 0, 100, int(mix.get(ch, 0)), 1, key=f"m11_mix_{ch}")
+    total = sum(mix.values())
+    if total != 100:
+        st.warning(f"目前合計：{total}%（建議調整為 100%）")
+    st.session_state["channel_mix"] = mix
+
+    days = (st.session_state.get("m11_end") - st.session_state.get("m11_start")).days + 1
+    days = max(days, 1)
+    start_day = st.session_state.get("m11_start")
+    industry_now = st.session_state.get("m11_industry")
+    card = active_rate_card()
+    summary = proposal_summary(st.session_state.get("m11_budget", 0), mix, start_day, days, industry_now, card)
+    rates = summary["rates"]
+    st.subheader("提案摘要 / 報價與成效（自動連動）")
+    st.caption(f"此配比將同步帶入『渠道與文案製作』頁面。費率表版本：{summary['version']}｜反應曲線：{summary['curves']}（CPA 依每日花費邊際遞減）")
+    if summary["missing"]:
+        st.warning(f"費率表在此檔期內沒有完整費率，以下渠道未計入報價與成效估算：{'、'.join(summary['missing'])}")
+    cA, cB, cC = st.columns(3)
+    cA.metric("檔期天數", days)
+    cB.metric("預估報價 (TWD)", f"{summary['報價']:,}")
+    est = summary["KPI"]
+    cC.metric("預估 CTR(%)", est["CTR"])
+    cA.metric("預估 CPA", est["CPA"])
+    cB.metric("預估 轉換", est["轉換"])
+    cC.metric("預估 ROAS", est["ROAS"])
+    ta_names = st.session_state.get("selected_ta", [])
+    rf = reach_frequency(st.session_state.get("m11_budget", 0), mix, *persona_reach_inputs(ta_names))
+    cA.metric("預估不重複觸及", f"{rf['觸及']:,}")
+    cB.metric("平均接觸頻次", rf["頻次"])
+    cC.metric("TA 觸及率", f"{rf['觸及率']:.1%}")
+    st.caption((f"受眾：已選 {len(ta_names)} 個 TA" if ta_names else "受眾：尚未圈選 TA，以全部 Persona 估算")
+               + f"，去重後約 {rf['TA人數']:,} 人；預估曝光 {rf['曝光']:,} 次。")
+    if st.toggle("顯示不確定區間（P10 / P50 / P90）", key="m11_mc"):
+        bands = _mix_kpi_bands(st.session_state.get("m11_budget", 0), tuple(sorted(mix.items())), days,
+                               tuple(sorted(rates["ctr"].items())), tuple(sorted(rates["cpa"].items())), industry_now, summary["curves"])
+        if bands:
+            st.dataframe(pd.DataFrame(bands, index=["P10","P50","P90"]).T.rename_axis("KPI"), use_container_width=True)
+            st.caption(f"以 {MC_SCENARIOS:,} 組各渠道 CTR／CPA 情境模擬（對數常態，CV 分別為 {MC_CTR_CV:.0%}／{MC_CPA_CV:.0%}）。")
+    with st.expander("查看報價明細"):
+        st.write(summary["明細表"])
+        memo = pricing_memo_stats()
+        st.caption(f"報價快取：命中率 {memo['hit_rate']:.0%}（{memo['hits']:,} / {memo['hits'] + memo['misses']:,}），"
+                   f"{memo['size']:,} / {memo['capacity']:,} 筆")
+    with st.expander("What-if：預算 × 檔期天數"):
+        base_budget = max(int(st.session_state.get("m11_budget", 0)), 10000)
+        grid_df = _what_if_grid(tuple(sorted(mix.items())), base_budget, start_day, industry_now, card["version"], summary["curves"])
+        st.caption(f"目前配比下，預算 {grid_df['預算'].min():,}–{grid_df['預算'].max():,} TWD × 1–{WHAT_IF_DAYS} 天的報價與預估轉換。")
+        for field, title in [("轉換", "預估轉換"), ("報價", "預估報價 (TWD)")]:
+            heat = alt.Chart(grid_df, title=title).mark_rect().encode(
+                x=alt.X("天數:O"),
+                y=alt.Y("預算:O", sort="descending", axis=alt.Axis(format=",")),
+                color=alt.Color(f"{field}:Q"),
+                tooltip=["預算", "天數", "報價", "轉換"],
+            )
+            st.altair_chart(heat, use_container_width=True)
+
+@_fragment_every(0.5)
+def _m13_job_progress(job_id):
+    """背景分析進度條；只有這段定時重跑，工作結束後整頁重跑一次以顯示結果。"""
+    status = profile_job_status(job_id)
+    if status is None or status["state"] != "running":
+        st.rerun()
+    size = f"{status['total_bytes'] / 2**20:,.1f} MB"
+    if status["progress"] is None:
+        st.info(f"分析中…（{size}，此檔案無法預估進度）")
+    else:
+        st.progress(status["progress"], text=f"分析中… {status['progress']:.0%}（{size}）")
+
 def m1_page():
     page_header("提案目標與報價", extra_tag=(f"追蹤代碼 {st.session_state['order_code']}" if st.session_state.get("order_code") else None))
     tabs = st.tabs(["媒體提案","市調提案","Shopper 分析","客製分析"])
@@ -261,8 +391,8 @@ def m1_page():
         with st.expander("輸入引導", expanded=True):
             col1, col2 = st.columns(2)
             brand = col1.text_input("品牌名稱", key="m11_brand")
-            industry = col2.selectbox("產業", ["保健","運動/健身","寵物","家電","FMCG","美妝","其他"], key="m11_industry")
-            goal = col1.selectbox("行銷目標", ["曝光","名單","購買"], key="m11_goal")
+            industry = col2.selectbox("產業", INDUSTRIES, key="m11_industry")
+            goal = col1.selectbox("行銷目標", GOALS, key="m11_goal")
             budget = col2.number_input("預算（TWD）", min_value=0, step=10000, value=200000, key="m11_budget")
             start_d = col1.date_input("檔期（開始）", value=date.today(), key="m11_start")
             end_d = col2.date_input("檔期（結束）", value=date.today() + timedelta(days=13), key="m11_end")
@@ -291,35 +421,33 @@ def m1_page():
                     st.rerun()
 
         st.divider()
-        st.subheader("渠道配比（可調整，將連動報價）")
-        goal_for_mix = st.session_state.get("m11_goal","曝光")
-        default_mix = st.session_state.get("channel_mix") or GOAL_TEMPLATES.get(goal_for_mix, GOAL_TEMPLATES["曝光"]).copy()
-        for ch in CHANNELS_8:
-            default_mix.setdefault(ch, 0)
-        mix = default_mix
-        cols = st.columns(4)
-        for idx, ch in enumerate(CHANNELS_8):
-            mix[ch] = cols[idx % 4].slider(ch, 0, 100, int(mix.get(ch, 0)), 1, key=f"m11_mix_{ch}")
-        total = sum(mix.values())
-        if total != 100:
-            st.warning(f"目前合計：{total}%（建議調整為 100%）")
-        st.session_state["channel_mix"] = mix
-
-        days = (st.session_state.get("m11_end") - st.session_state.get("m11_start")).days + 1
-        days = max(days, 1)
-        quote, quote_breakdown = quote_by_days_and_mix(days, mix)
-        st.subheader("提案摘要 / 報價與成效（自動連動）")
-        st.caption("此配比將同步帶入『渠道與文案製作』頁面。")
-        cA, cB, cC = st.columns(3)
-        cA.metric("檔期天數", days)
-        cB.metric("預估報價 (TWD)", f"{quote:,}")
-        est = estimate_by_mix(st.session_state.get("m11_budget", 0), mix)
-        cC.metric("預估 CTR(%)", est["CTR"])
-        cA.metric("預估 CPA", est["CPA"])
-        cB.metric("預估 轉換", est["轉換"])
-        cC.metric("預估 ROAS", est["ROAS"])
-        with st.expander("查看報價明細"):
-            st.write(pd.DataFrame({"渠道": list(quote_breakdown.keys()), "金額(TWD)": list(quote_breakdown.values())}))
+        with st.expander("🔧 AI 最佳化配比（預算限制下最大化轉換／曝光）"):
+            days_opt = max((st.session_state.get("m11_end") - st.session_state.get("m11_start")).days + 1, 1)
+            st.caption(f"在 報價 ≤ 預算（{st.session_state.get('m11_budget', 0):,} TWD，{days_opt} 天）與各渠道上下限內，"
+                       f"{'最大化已選 TA 的不重複觸及' if st.session_state.get('m11_goal') == '曝光' else '最大化預估轉換'}。")
+            bounds = st.data_editor(
+                pd.DataFrame({"渠道": CHANNELS_8, "最低%": [0]*len(CHANNELS_8), "最高%": [100]*len(CHANNELS_8)}),
+                disabled=["渠道"], hide_index=True, use_container_width=True, key="m11_opt_bounds")
+            if st.button("計算最佳配比", key="m11_opt_run"):
+                opt_rates = flight_rate_tables(active_rate_card(), st.session_state.get("m11_start"), days_opt, st.session_state.get("m11_industry"))
+                opt_sizes, opt_affinity = persona_reach_inputs(st.session_state.get("selected_ta", []))
+                st.session_state["m11_opt_result"] = optimize_mix(
+                    st.session_state.get("m11_budget", 0), days_opt, st.session_state.get("m11_goal", "曝光"),
+                    lo=dict(zip(bounds["渠道"], bounds["最低%"].fillna(0))), hi=dict(zip(bounds["渠道"], bounds["最高%"].fillna(100))),
+                    day_rate=opt_rates["day_rate"], unit_ctr=opt_rates["ctr"], unit_cpa=opt_rates["cpa"],
+                    curves=active_response_curves(), industry=st.session_state.get("m11_industry"),
+                    sizes=opt_sizes, affinity=opt_affinity)
+                if not st.session_state["m11_opt_result"]:
+                    st.warning("在目前預算與上下限內找不到可行配比：請提高預算、縮短檔期或放寬渠道上下限"
+                               "（檔期內查不到費率的渠道不會被配到預算）。")
+            for rank, res in enumerate(st.session_state.get("m11_opt_result") or []):
+                label = "最佳方案" if rank == 0 else f"次佳方案 {rank}"
+                reach = f"｜觸及 {res['觸及']:,}" if "觸及" in res else ""
+                st.markdown(f"**{label}**｜報價 {res['報價']:,}{reach}｜CTR {res['CTR']}%｜CPA {res['CPA']}｜轉換 {res['轉換']:,}｜ROAS {res['ROAS']}")
+                st.caption("、".join(f"{ch} {v}%" for ch, v in res["mix"].items() if v))
+                st.button("套用此配比", key=f"m11_opt_apply_{rank}", on_click=_m11_apply_mix, args=(res["mix"],))
+
+        _m11_mix_and_summary()
 
         if st.button("生成正式委刊單（含追蹤代碼）", key="m11_gen_io"):
             st.session_state["order_code"] = gen_order_code()
@@ -373,29 +501,64 @@ def m1_page():
     # ---- Tab 1-3 Shopper 分析 ----
     with tabs[2]:
         st.subheader("上傳名單進行 Shopper 分析")
-        uploaded = st.file_uploader("上傳名單（CSV 或 XLSX）", type=["csv","xlsx"], key="m13_upload")
-        if uploaded:
-            try:
-                if uploaded.name.endswith(".csv"):
-                    df = pd.read_csv(uploaded)
-                else:
-                    df = pd.read_excel(uploaded, engine="openpyxl")
-                st.dataframe(df.head())
-                st.write(f"筆數：{len(df)}")
-                if "region" in df.columns or "地區" in df.columns:
-                    col = "region" if "region" in df.columns else "地區"
-                    st.bar_chart(df[col].value_counts())
+        # 刪除名單時換一個 key，上傳元件連同伺服器上的檔案一起清掉
+        uploaded = st.file_uploader("上傳名單（CSV 或 XLSX）", type=["csv","xlsx"],
+                                    key=f"m13_upload_{st.session_state['m13_upload_nonce']}")
+        result = st.session_state["m13_result"]
+        if not uploaded or (result and result["file_id"] != uploaded.file_id):
+            # 移除或換了檔案：前一份名單的樣本列不留在 session
+            st.session_state["m13_result"] = result = None
+        if uploaded and result is None:
+            # 分析丟到背景執行緒（逐 chunk 讀取、只保留彙總與前幾列樣本）；session 只記 job id，之後的 rerun 只查進度不重跑
+            job = st.session_state["m13_job"]
+            status = profile_job_status(job["id"]) if job and job["file_id"] == uploaded.file_id else None
+            if status is None:
+                job = {"id": submit_profile_job(uploaded.getvalue(), uploaded.name), "file_id": uploaded.file_id}
+                st.session_state["m13_job"] = job
+                status = profile_job_status(job["id"])
+            if status["state"] == "running":
+                _m13_job_progress(job["id"])
+            else:
+                # 結果（含樣本列）取走後只存在這個 session，伺服器上的工作表不再保留
+                status = collect_profile_job(job["id"]) or status
+                st.session_state["m13_job"] = None
+                st.session_state["m13_result"] = result = {
+                    "file_id": uploaded.file_id, "key": status["key"], "cached": status["cached"],
+                    "profile": status["result"], "error": status["error"],
+                }
+        if result is not None:
+            if result["error"]:
+                st.error(f"讀取失敗：{result['error']}")
+            else:
+                profile = result["profile"]
+                st.dataframe(profile["head"])
+                st.write(f"筆數：{profile['rows']}")
+                if profile["region_col"]:
+                    st.bar_chart(profile["region_counts"])
+                with st.expander("欄位輪廓"):
+                    st.dataframe(profile["columns"], hide_index=True, use_container_width=True)
+                    cache = profile_cache_stats()
+                    st.caption(("相同內容的名單已分析過，直接使用快取結果。" if result["cached"] else "")
+                               + f"名單快取：{cache['size']:,} 份、{cache['bytes'] / 2**10:,.0f} KB / "
+                               f"{cache['capacity_bytes'] / 2**20:,.0f} MB，命中率 {cache['hit_rate']:.0%}")
                 st.session_state["insight_from_upload"] = {
-                    "rows": len(df),
-                    "top_region": df["region"].value_counts().idxmax() if "region" in df.columns else None,
+                    "rows": profile["rows"],
+                    "top_region": profile["top_region"],
                     "note": "基於上傳名單的初步輪廓，已導入 產業與市場洞察 > 提案分析。"
                 }
                 st.success("分析完成，已同步到 產業與市場洞察。")
-            except Exception as e:
-                st.error(f"讀取失敗：{e}")
+            if st.button("刪除此名單", key="m13_delete"):
+                profile_cache_clear(result["key"])
+                st.session_state["m13_result"] = None
+                st.session_state["insight_from_upload"] = None
+                st.session_state["m13_upload_nonce"] += 1
+                st.rerun()
 
         st.divider()
-        st.caption("個資使用宣告：上傳之名單僅用於本次分析，不會儲存於伺服器。您可隨時要求刪除。")
+        st.caption("個資使用宣告：上傳之名單僅用於本次分析。前幾列樣本只保留在您這次的工作階段；伺服器僅暫存彙總統計"
+                   "（筆數、各欄空值／相異值／數值範圍、地區分佈；編號、電話等幾乎每列不同的欄位不記數值範圍），"
+                   "供相同檔案重傳時直接使用，不含其他個別會員資料。"
+                   "按「刪除此名單」可立即清除本次上傳與伺服器上的彙總結果。")
 
     # ---- Tab 1-4 客製分析 ----
     with tabs[3]:
@@ -406,82 +569,437 @@ def m1_page():
 
 # ---------- Module 2：TA 預測與圈選 ----------
 
-def normalize_persona(df):
+PERSONA_PAIN_POOL = ["價格敏感","怕踩雷","資訊過載","選擇困難","時間不足","需要快速見效","售後疑慮","物流/取貨不便","品牌信任不足","比較成本高"]
+PERSONA_ATT_POOL = ["品牌忠誠高","品牌忠誠中等","品牌忠誠低","重口碑","重規格","重CP值","重體驗","嘗鮮型","保守型","線上偏好","線下偏好","混合通路"]
+
+def pick_column(cols, cands, default=None):
+    for c in cands:
+        if c in cols: return c
+    return default
+
+def normalize_persona_frame(df):
+    """欄位挑選、規模指派、痛點/態度補值全部以欄為單位處理，回傳 name/size/pain/keywords/slots/attitudes 六欄。"""
     cols = df.columns.tolist()
-    def pick(cands, default=None):
-        for c in cands:
-            if c in cols: return c
-        return default
-    name_col = pick(["Persona","名稱","人物","族群","TA","人設"], cols[0] if cols else None)
-    size_col = pick(["規模","人數","樣本數","估計規模"], None)
-    pain_col = pick(["痛點","需求","阻礙"], None)
-    kw_col   = pick(["關鍵字","關鍵詞","Keywords"], None)
-    slot_col = pick(["推薦版位","偏好版位","版位","渠道偏好"], None)
-    att_col  = pick(["消費態度","態度","傾向","Attitude"], None)
-
-    import numpy as _np
-    rng = _np.random.default_rng(2025)
-    pain_pool = ["價格敏感","怕踩雷","資訊過載","選擇困難","時間不足","需要快速見效","售後疑慮","物流/取貨不便","品牌信任不足","比較成本高"]
-    att_pool = ["品牌忠誠高","品牌忠誠中等","品牌忠誠低","重口碑","重規格","重CP值","重體驗","嘗鮮型","保守型","線上偏好","線下偏好","混合通路"]
-
-    items = []
-    used_sizes = set()
-    for idx, (_, row) in enumerate(df.iterrows()):
-        name = str(row.get(name_col, f"Persona_{idx+1}"))
-        size = int(rng.integers(50000, 300001))
-        tries = 0
-        while size in used_sizes and tries < 5:
-            size = int(rng.integers(50000, 300001)); tries += 1
-        used_sizes.add(size)
-
-        raw_pain = row.get(pain_col, None)
-        if raw_pain is None or (isinstance(raw_pain, float) and _np.isnan(raw_pain)) or str(raw_pain).strip()=="" or idx < len(pain_pool):
-            pain = pain_pool[idx % len(pain_pool)]
-        else:
-            pain = str(raw_pain)
+    n = len(df)
+    name_col = pick_column(cols, PERSONA_NAME_COLUMNS, cols[0] if cols else None)
+    pain_col = pick_column(cols, ["痛點","需求","阻礙"])
+    kw_col   = pick_column(cols, ["關鍵字","關鍵詞","Keywords"])
+    slot_col = pick_column(cols, ["推薦版位","偏好版位","版位","渠道偏好"])
+    att_col  = pick_column(cols, ["消費態度","態度","傾向","Attitude"])
+
+    rng = np.random.default_rng(2025)
+    idx = np.arange(n)
+
+    def text_col(col, default):
+        if col is None:
+            return pd.Series(default, index=df.index, dtype=object)
+        return df[col].fillna("").astype(str).astype(object)
+
+    if name_col is None:
+        names = pd.Series([f"Persona_{i+1}" for i in idx], index=df.index, dtype=object)
+    else:
+        names = df[name_col].astype(str).astype(object)
+
+    # 規模：50,000–300,000 之間一次抽出且互不重複（超過可用值個數時才允許重複）
+    span = 300001 - 50000
+    if n <= span:
+        sizes = rng.choice(span, size=n, replace=False) + 50000
+    else:
+        sizes = rng.integers(50000, 300001, size=n)
+
+    # 痛點：前 len(pool) 筆與空值以 pool 輪替補上
+    pool = np.array(PERSONA_PAIN_POOL, dtype=object)
+    pains = text_col(pain_col, "")
+    fill_pain = pains.str.strip().eq("").to_numpy() | (idx < len(pool))
+    pains = pains.to_numpy(dtype=object, copy=True)
+    pains[fill_pain] = pool[idx[fill_pain] % len(pool)]
+
+    # 消費態度：空值抽兩個不重複的態度
+    attitudes = text_col(att_col, "")
+    fill_att = attitudes.str.strip().eq("").to_numpy()
+    attitudes = attitudes.to_numpy(dtype=object, copy=True)
+    m = int(fill_att.sum())
+    if m:
+        att_pool = np.array(PERSONA_ATT_POOL, dtype=object)
+        pairs = np.argsort(rng.random((m, len(att_pool))), axis=1)[:, :2]
+        attitudes[fill_att] = att_pool[pairs[:, 0]] + "、" + att_pool[pairs[:, 1]]
+
+    return pd.DataFrame({
+        "name": names.to_numpy(dtype=object),
+        "size": sizes.astype(np.int64),
+        "pain": pains,
+        "keywords": text_col(kw_col, "").to_numpy(dtype=object),
+        "slots": text_col(slot_col, "FB/Google/Line").to_numpy(dtype=object),
+        "attitudes": attitudes,
+    })
 
-        kw   = str(row.get(kw_col,"")) if kw_col else ""
-        slot = str(row.get(slot_col,"")) if slot_col else "FB/Google/Line"
+def persona_records(frame):
+    keys = frame.columns.tolist()
+    return [dict(zip(keys, row)) for row in zip(*(frame[c].tolist() for c in keys))]
 
-        raw_att = row.get(att_col, None) if att_col else None
-        if raw_att is None or (isinstance(raw_att, float) and _np.isnan(raw_att)) or str(raw_att).strip()=="":
-            atts = rng.choice(att_pool, size=2, replace=False)
-            attitudes = "、".join(atts.tolist())
-        else:
-            attitudes = str(raw_att)
-
-        items.append({"name":name,"size":size,"pain":pain,"keywords":kw,"slots":slot,"attitudes":attitudes})
-    return items
-
-def pick_ai_recommended_personas(items, industry, goal, k=5):
-    scores = []
-    ind_kw = str(industry or "").lower()
-    goal_kw = str(goal or "").lower()
-    for it in items:
-        s = 0
-        text = (it["name"]+" "+it["pain"]+" "+it["keywords"]+" "+it["slots"]+" "+it["attitudes"]).lower()
-        if "美妝" in ind_kw or "beauty" in ind_kw:
-            s += ("妝" in text) * 2 + ("女性" in text) * 1
-        if "家電" in ind_kw or "appliance" in ind_kw:
-            s += ("理性" in text) * 2 + ("比價" in text) * 2 + ("功能" in text) * 1
-        if "保健" in ind_kw:
-            s += ("健康" in text) * 2 + ("上班" in text) * 1
-        if "寵物" in ind_kw:
-            s += ("寵物" in text) * 3
-        if "運動" in ind_kw or "健身" in ind_kw:
-            s += ("健身" in text) * 3 + ("效率" in text)*1
-        if "fmcg" in ind_kw:
-            s += ("比價" in text) * 1 + ("促銷" in text)*1
-        if "曝光" in goal_kw:
-            s += ("社群" in text) + ("口碑" in text) + ("年輕" in text)
-        if "名單" in goal_kw:
-            s += ("搜尋" in text) + ("關鍵字" in text) + ("line" in text) + ("edm" in text)
-        if "購買" in goal_kw:
-            s += ("比價" in text) + ("功能" in text) + ("評價" in text)
-        s += min(it["size"]/200000, 1.0)
-        scores.append((s, it))
-    scores.sort(key=lambda x: x[0], reverse=True)
-    return [it for _, it in scores[:k]]
+def normalize_persona(df):
+    return persona_records(normalize_persona_frame(df))
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _persona_frame_cached(fingerprint, _df):
+    return normalize_persona_frame(_df)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _persona_items_cached(fingerprint, _df):
+    return persona_records(_persona_frame_cached(fingerprint, _df))
+
+def persona_frame():
+    """目前 session 所用 Persona 目錄的正規化結果（依目錄指紋快取，所有 session 共用）。"""
+    ss = st.session_state
+    return _persona_frame_cached(ss["persona_fp"], ss["persona_df"])
+
+def persona_items():
+    ss = st.session_state
+    return _persona_items_cached(ss["persona_fp"], ss["persona_df"])
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _persona_reach_inputs_cached(fingerprint, _df):
+    frame = _persona_frame_cached(fingerprint, _df)
+    return {
+        "index": pd.Index(frame["name"]),
+        "sizes": frame["size"].to_numpy(dtype=np.float64),
+        "mask": channel_slot_mask(frame["slots"], CHANNELS_8),
+    }
+
+def persona_reach_inputs(names=None):
+    """觸及估算用的 (規模, persona × 渠道可觸及比例)；names 為已選 TA，空白時以整個目錄為受眾。"""
+    ss = st.session_state
+    cached = _persona_reach_inputs_cached(ss["persona_fp"], ss["persona_df"])
+    if not names:
+        return cached["sizes"], affinity_matrix(cached["mask"], CHANNELS_8)
+    pos = cached["index"].get_indexer(list(names))
+    found = pos >= 0
+    sizes_map = ss.get("selected_ta_sizes", {})
+    # 不在目前目錄中的 TA（例如換過目錄）沿用選取時記下的規模，渠道偏好視為未知
+    sizes = np.where(found, cached["sizes"][pos], [float(sizes_map.get(n, 0)) for n in names])
+    mask = np.where(found, cached["mask"][pos], 0)
+    return sizes, affinity_matrix(mask, CHANNELS_8)
+
+# 推薦計分規則：token, industry, goal, weight（industry/goal 以 | 分隔別名，空白代表不限）
+PERSONA_RULES_PATH = os.path.join(".", "persona_score_rules.csv")
+PERSONA_RULE_COLUMNS = ["token","industry","goal","weight"]
+
+def load_persona_score_rules(path=PERSONA_RULES_PATH):
+    try:
+        rules = pd.read_csv(path, dtype=str, keep_default_na=False)
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return pd.DataFrame(columns=PERSONA_RULE_COLUMNS)
+    rules = rules[PERSONA_RULE_COLUMNS].copy()
+    rules["token"] = rules["token"].str.strip().str.lower()
+    rules["weight"] = pd.to_numeric(rules["weight"], errors="coerce").fillna(0.0)
+    return rules[rules["token"] != ""].reset_index(drop=True)
+
+def persona_search_text(frame):
+    return (frame["name"]+" "+frame["pain"]+" "+frame["keywords"]+" "+frame["slots"]+" "+frame["attitudes"]).astype(str).str.lower()
+
+def build_persona_keyword_index(frame, tokens):
+    """倒排索引：token -> 含有該 token 的 persona 位置（int32）。每個目錄只建一次。"""
+    text = persona_search_text(frame)
+    postings = {tok: np.flatnonzero(text.str.contains(tok, regex=False).to_numpy(dtype=bool)).astype(np.int32) for tok in tokens}
+    return {"n": len(frame), "sizes": frame["size"].to_numpy(dtype=np.float64), "postings": postings}
+
+def _rule_hits(aliases, value):
+    value = str(value or "").lower()
+    return any(a and a in value for a in str(aliases).lower().split("|"))
+
+def persona_rule_weights(rules, tokens, industry, goal):
+    """將規則表套用到 (industry, goal)，回傳對應 tokens 順序的權重向量；同一 token 命中多條規則時相加。"""
+    pos = {tok: i for i, tok in enumerate(tokens)}
+    w = np.zeros(len(tokens))
+    for tok, ind, g, wt in rules[PERSONA_RULE_COLUMNS].itertuples(index=False):
+        if ind and not _rule_hits(ind, industry):
+            continue
+        if g and not _rule_hits(g, goal):
+            continue
+        w[pos[tok]] += wt
+    return w
+
+def compile_persona_scoring(frame, rules):
+    """把規則表編譯成 persona × token 的稀疏特徵矩陣（CSC：indptr/indices）與 token × (產業,目標) 權重矩陣。"""
+    tokens = list(dict.fromkeys(rules["token"].tolist()))
+    index = build_persona_keyword_index(frame, tokens)
+    postings = [index["postings"][tok] for tok in tokens]
+    indptr = np.zeros(len(tokens)+1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(p) for p in postings])
+    combos = [(ind, g) for ind in INDUSTRIES for g in GOALS]
+    W = np.column_stack([persona_rule_weights(rules, tokens, ind, g) for ind, g in combos]) if tokens else np.zeros((0, len(combos)))
+    return {
+        "n": index["n"],
+        "tokens": tokens,
+        "rules": rules,
+        "indptr": indptr,
+        "indices": np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32),
+        "size_score": np.minimum(index["sizes"]/200000, 1.0),
+        "sizes": index["sizes"],
+        "names": frame["name"].to_numpy(dtype=object),
+        "combos": combos,
+        "W": W,
+    }
+
+def score_personas(model, industry, goal):
+    """所有 persona 對單一 (industry, goal) 的分數：size 分數 + X @ w。"""
+    w = persona_rule_weights(model["rules"], model["tokens"], industry, goal)
+    nnz_w = np.repeat(w, np.diff(model["indptr"]))
+    return model["size_score"] + np.bincount(model["indices"], weights=nnz_w, minlength=model["n"])
+
+def score_all_persona_combos(model):
+    """一次算出所有 persona 對每個 (產業, 目標) 組合的分數，回傳 (n × 組合數) 矩陣與組合清單。"""
+    out = np.repeat(model["size_score"][:, None], len(model["combos"]), axis=1)
+    indptr, indices, W = model["indptr"], model["indices"], model["W"]
+    for j in range(len(model["tokens"])):
+        out[indices[indptr[j]:indptr[j+1]]] += W[j]
+    return out, model["combos"]
+
+def top_k_personas(scores, sizes, names, k):
+    """部分選取前 k 名（argpartition，不做全排序）；同分依 規模大→小、名稱 排序，結果固定。"""
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if n > k:
+        kth = np.partition(scores, n-k)[n-k]
+        above = np.flatnonzero(scores > kth)
+        # 與第 k 名同分者再依規模篩一次；剩下同分同規模的才交給名稱決定，不依賴 partition 的內部順序
+        tied = np.flatnonzero(scores == kth)
+        need = k - len(above)
+        if len(tied) > need:
+            size_kth = np.partition(sizes[tied], len(tied)-need)[len(tied)-need]
+            tied = tied[sizes[tied] >= size_kth]
+        cand = np.concatenate([above, tied])
+    else:
+        cand = np.arange(n)
+    order = np.lexsort((names[cand], -sizes[cand], -scores[cand]))
+    return cand[order[:k]]
+
+def pick_ai_recommended_personas(items, industry, goal, k=5, model=None):
+    if model is None:
+        frame = pd.DataFrame(items, columns=["name","size","pain","keywords","slots","attitudes"])
+        model = compile_persona_scoring(frame, load_persona_score_rules())
+    scores = score_personas(model, industry, goal)
+    top = top_k_personas(scores, model["sizes"], model["names"], k)
+    return [items[i] for i in top]
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _persona_scoring_cached(fingerprint, rules_stamp, _df):
+    return compile_persona_scoring(_persona_frame_cached(fingerprint, _df), load_persona_score_rules())
+
+def persona_scoring_model():
+    """目前目錄 + 規則表的計分模型；任一檔案更新（指紋改變）時自動重新編譯。"""
+    ss = st.session_state
+    return _persona_scoring_cached(ss["persona_fp"], persona_file_stamp(PERSONA_RULES_PATH), ss["persona_df"])
+
+PERSONA_SORTS = ["規模（大→小）","規模（小→大）","名稱"]
+PERSONA_PAGE_SIZES = [30, 60, 120]
+
+@st.cache_resource(max_entries=12, show_spinner=False)
+def _persona_order_cached(fingerprint, sort_key, _df):
+    frame = _persona_frame_cached(fingerprint, _df)
+    names = frame["name"].to_numpy(dtype=object)
+    sizes = frame["size"].to_numpy()
+    if sort_key == "規模（小→大）":
+        return np.lexsort((names, sizes))
+    if sort_key == "名稱":
+        return np.argsort(names, kind="stable")
+    return np.lexsort((names, -sizes))
+
+_NGRAM_SHIFT = np.uint64(21)       # Unicode code point < 2**21
+_BIGRAM_BASE = np.uint64(1 << 42)  # bigram 鍵值放在 unigram 之後，兩者共用一張表
+
+def _ngram_keys(cps):
+    """code point 陣列 -> (unigram 鍵, bigram 鍵)。"""
+    cps = cps.astype(np.uint64)
+    return cps, _BIGRAM_BASE + ((cps[:-1] << _NGRAM_SHIFT) | cps[1:])
+
+def _unique_pairs(keys, docs, n):
+    """依 (key, doc) 排序並去重，回傳 (keys, docs)。
+
+    (key, doc) 能打包進一個 uint64 時排序最快；key 最大約 2**43，persona 超過約 200 萬筆後
+    key × n 會溢位而互相碰撞，此時改用 lexsort（慢約 10 倍但不會出錯）。
+    """
+    if not len(keys) or (int(keys.max()) + 1) * n <= 2**64:
+        pairs = np.sort(keys * np.uint64(n) + docs)
+        pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]]
+        return pairs // np.uint64(n), (pairs % np.uint64(n)).astype(np.int32)
+    order = np.lexsort((docs, keys))
+    keys, docs = keys[order], docs[order]
+    keep = np.r_[True, (keys[1:] != keys[:-1]) | (docs[1:] != docs[:-1])]
+    return keys[keep], docs[keep].astype(np.int32)
+
+def build_persona_ngram_index(frame):
+    """以字元 unigram/bigram 對 name、痛點、關鍵字、推薦版位、消費態度 建倒排索引（CSR：keys/indptr/docs）。"""
+    text = persona_search_text(frame).to_numpy(dtype=object)
+    n = len(text)
+    if n == 0:
+        return {"n": 0, "text": text, "keys": np.zeros(0, np.uint64), "indptr": np.zeros(1, np.int64), "docs": np.zeros(0, np.int32)}
+    # 以 \x00 串接所有文字後一次轉成 code point，跨文件與含空白的 n-gram 直接濾掉
+    joined = "\x00".join(text.tolist())
+    cps = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32)
+    lengths = np.fromiter((len(t)+1 for t in text), dtype=np.int64, count=n)
+    doc = np.repeat(np.arange(n, dtype=np.uint64), lengths)[:len(cps)]
+    ok = (cps != 0) & (cps != 0x20)
+    uni, bi = _ngram_keys(cps)
+    keys = np.concatenate([uni[ok], bi[ok[:-1] & ok[1:]]])
+    docs = np.concatenate([doc[ok], doc[:-1][ok[:-1] & ok[1:]]])
+    pair_keys, pair_docs = _unique_pairs(keys, docs, n)
+    starts = np.flatnonzero(np.r_[True, pair_keys[1:] != pair_keys[:-1]])
+    return {"n": n, "text": text, "keys": pair_keys[starts], "indptr": np.append(starts, len(pair_keys)).astype(np.int64), "docs": pair_docs}
+
+def _ngram_postings(index, key):
+    i = np.searchsorted(index["keys"], key)
+    if i >= len(index["keys"]) or index["keys"][i] != key:
+        return np.zeros(0, dtype=np.int32)
+    return index["docs"][index["indptr"][i]:index["indptr"][i+1]]
+
+def search_persona_ngrams(index, query):
+    """空白分隔多個詞（AND）；每個詞先以 n-gram posting 交集取候選，再對候選做字串比對確認。"""
+    terms = [t for t in str(query or "").lower().split() if t]
+    result = None
+    for term in terms:
+        cps = np.frombuffer(term.encode("utf-32-le"), dtype=np.uint32)
+        uni, bi = _ngram_keys(cps)
+        postings = sorted((_ngram_postings(index, k) for k in (bi if len(term) > 1 else uni)), key=len)
+        cand = postings[0]
+        for p in postings[1:]:
+            if not len(cand):
+                break
+            cand = np.intersect1d(cand, p, assume_unique=True)
+        if len(term) > 2 and len(cand):
+            text = index["text"]
+            cand = cand[np.fromiter((term in text[i] for i in cand), dtype=bool, count=len(cand))]
+        result = cand if result is None else np.intersect1d(result, cand, assume_unique=True)
+        if not len(result):
+            break
+    return np.arange(index["n"]) if result is None else result
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _persona_ngram_cached(fingerprint, _df):
+    return build_persona_ngram_index(_persona_frame_cached(fingerprint, _df))
+
+def persona_ngram_index():
+    ss = st.session_state
+    return _persona_ngram_cached(ss["persona_fp"], ss["persona_df"])
+
+def persona_browse_positions(frame, order, query="", exclude_names=(), index=None):
+    """伺服器端搜尋 + 排序：回傳依 order 排好、符合搜尋的 persona 位置。"""
+    keep = ~np.isin(frame["name"].to_numpy(dtype=object), list(exclude_names))
+    if str(query or "").strip():
+        hits = np.zeros(len(frame), dtype=bool)
+        hits[search_persona_ngrams(index if index is not None else build_persona_ngram_index(frame), query)] = True
+        keep &= hits
+    return order[keep[order]]
+
+def _m2_select_all(names, sizes):
+    """把搜尋結果整批併入 selected_ta / selected_ta_sizes；清掉網格 checkbox 狀態讓它們依新的選取重畫。"""
+    ss = st.session_state
+    selections = set(ss.get("selected_ta", []))
+    sizes_map = dict(ss.get("selected_ta_sizes", {}))
+    selections.update(names)
+    sizes_map.update(zip(names, sizes))
+    ss["selected_ta"] = list(selections)
+    ss["selected_ta_sizes"] = sizes_map
+    for k in [k for k in ss.keys() if str(k).startswith("m2_all_")]:
+        del ss[k]
+
+def _m2_reset_page():
+    st.session_state["m2_page"] = 1
+
+# ---------- Persona 相似度（TF-IDF × 字元 bigram，hashing 到固定維度） ----------
+
+PERSONA_CACHE_DIR = os.path.join(".", ".persona_cache")
+PERSONA_SIM_DIM = 256      # 2 的次方；100k persona 約 100MB（float32）
+PERSONA_SIM_BLOCK = 16384  # 查詢時分塊做矩陣乘法，避免一次配置大暫存
+PERSONA_SIM_KEEP = 4       # 快取目錄最多保留幾份相似度矩陣（依最近使用時間淘汰，同 _persona_similarity_cached 的 max_entries）
+
+def build_persona_similarity(index, dim=PERSONA_SIM_DIM):
+    """由 n-gram 索引算出 L2 正規化的 float32 (n × dim) 矩陣：binary TF × IDF，bigram 以 hashing trick 映射到 dim 維（含正負號）。"""
+    n = index["n"]
+    mat = np.zeros((n, dim), dtype=np.float32)
+    is_bi = index["keys"] >= _BIGRAM_BASE
+    counts = np.diff(index["indptr"])
+    idf = (np.log((1.0 + n) / (1.0 + counts)) + 1.0).astype(np.float32)
+    h = index["keys"] * np.uint64(0x9E3779B97F4A7C15)
+    dims = (h >> np.uint64(64 - int(np.log2(dim)))).astype(np.int64)
+    signs = np.where((h >> np.uint64(7)) & np.uint64(1), 1.0, -1.0).astype(np.float32)
+    per_key = np.where(is_bi, idf * signs, 0.0).astype(np.float32)
+    key_of_nnz = np.repeat(np.arange(len(counts)), counts)
+    np.add.at(mat, (index["docs"], dims[key_of_nnz]), per_key[key_of_nnz])
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    np.divide(mat, norms, out=mat, where=norms > 0)
+    return mat
+
+def persona_content_digest(frame, dim=PERSONA_SIM_DIM):
+    h = pd.util.hash_pandas_object(frame[["name","pain","keywords","slots","attitudes"]], index=False).to_numpy()
+    return hashlib.sha1(h.tobytes() + f"sim-v1-{dim}".encode()).hexdigest()[:20]
+
+def load_or_build_persona_similarity(frame, index, cache_dir=PERSONA_CACHE_DIR):
+    """相似度矩陣依內容 digest 存成 .npy，重啟後以 mmap 直接載入，不必重算；目錄只保留最近用過的 PERSONA_SIM_KEEP 份。"""
+    path = os.path.join(cache_dir, f"sim_{persona_content_digest(frame)}.npy")
+    if os.path.exists(path):
+        try:
+            mat = np.load(path, mmap_mode="r")
+            if mat.shape == (len(frame), PERSONA_SIM_DIM):
+                os.utime(path)  # 以 mtime 記錄最近使用時間，供淘汰時排序
+                return mat
+        except Exception:
+            pass
+    mat = build_persona_similarity(index)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(tmp, mat)
+        os.replace(tmp, path)
+        prune_persona_similarity_cache(cache_dir)
+    except OSError:
+        pass
+    return mat
+
+def prune_persona_similarity_cache(cache_dir=PERSONA_CACHE_DIR, keep=PERSONA_SIM_KEEP):
+    """刪掉最久沒用到的 sim_<digest>.npy，只留 keep 份；每份約 100MB，目錄每改一次都會多一份。"""
+    files = []
+    for name in os.listdir(cache_dir):
+        if name.startswith("sim_") and name.endswith(".npy") and ".tmp" not in name:
+            path = os.path.join(cache_dir, name)
+            try:
+                files.append((os.stat(path).st_mtime_ns, path))
+            except OSError:
+                pass
+    # 其他 process 若仍以 mmap 開著舊檔，刪除只移除目錄項，已對映的內容在關閉前仍可讀
+    for _, path in sorted(files, reverse=True)[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def similar_personas(mat, positions, sizes, names, k=5, exclude=()):
+    """以已選 persona 的質心為查詢向量，分塊矩陣乘法取 cosine 分數，再以 top_k_personas 取前 k。"""
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.int64)
+    q = np.asarray(mat[positions], dtype=np.float32).sum(axis=0)
+    norm = np.linalg.norm(q)
+    if norm == 0:
+        return np.zeros(0, dtype=np.int64)
+    q /= norm
+    n = mat.shape[0]
+    scores = np.empty(n, dtype=np.float32)
+    for start in range(0, n, PERSONA_SIM_BLOCK):
+        scores[start:start+PERSONA_SIM_BLOCK] = mat[start:start+PERSONA_SIM_BLOCK] @ q
+    scores[positions] = -np.inf
+    scores[np.asarray(list(exclude), dtype=np.int64)] = -np.inf
+    top = top_k_personas(scores, sizes, names, k)
+    return top[np.isfinite(scores[top])]
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _persona_similarity_cached(fingerprint, _df):
+    return load_or_build_persona_similarity(_persona_frame_cached(fingerprint, _df), _persona_ngram_cached(fingerprint, _df))
+
+def persona_similarity():
+    ss = st.session_state
+    return _persona_similarity_cached(ss["persona_fp"], ss["persona_df"])
 
 def m2_page():
     page_header("TA 預測與圈選", extra_tag=(f"追蹤代碼 {st.session_state['order_code']}" if st.session_state.get("order_code") else None))
@@ -490,13 +1008,12 @@ def m2_page():
         st.info("要開始圈選 TA，請先在「提案目標與報價」或「市調提案」生成正式委刊單（追蹤代碼）。")
         return
 
-    ensure_persona_loaded()
-    items = normalize_persona(st.session_state["persona_df"])
+    items = persona_items()
     industry = st.session_state.get("m11_industry","其他")
     goal = st.session_state.get("m11_goal","曝光")
 
     st.markdown("#### AI 推薦的 5 個 Persona")
-    recs = pick_ai_recommended_personas(items, industry, goal, k=5)
+    recs = pick_ai_recommended_personas(items, industry, goal, k=5, model=persona_scoring_model())
 
     selections = set(st.session_state.get("selected_ta", []))
     sizes_map = dict(st.session_state.get("selected_ta_sizes", {}))
@@ -512,25 +1029,58 @@ def m2_page():
             else:
                 selections.discard(it['name']); sizes_map.pop(it['name'], None)
 
+    query = st.text_input("🔍 搜尋 Persona（名稱／痛點／關鍵字／版位／態度，空白分隔多個詞，例如：通勤 比價）", key="m2_filter", on_change=_m2_reset_page)
     st.toggle("展開更多 TA", key="m2_expand_more")
-    if st.session_state.get("m2_expand_more"):
-        st.markdown("#### 更多 Persona")
+    if query.strip() or st.session_state.get("m2_expand_more"):
+        st.markdown("#### 搜尋結果" if query.strip() else "#### 更多 Persona")
+        ss = st.session_state
+        frame = persona_frame()
+        f2, f3 = st.columns(2)
+        sort_key = f2.selectbox("排序", PERSONA_SORTS, key="m2_sort", on_change=_m2_reset_page)
+        page_size = f3.selectbox("每頁筆數", PERSONA_PAGE_SIZES, key="m2_page_size", on_change=_m2_reset_page)
+        order = _persona_order_cached(ss["persona_fp"], sort_key, ss["persona_df"])
+        positions = persona_browse_positions(frame, order, query, exclude_names=[r['name'] for r in recs], index=persona_ngram_index())
+        if query.strip() and len(positions):
+            st.button(f"將 {len(positions):,} 個搜尋結果全部加入已選 TA", key="m2_select_all", on_click=_m2_select_all,
+                      args=(frame["name"].to_numpy(dtype=object)[positions].tolist(), frame["size"].to_numpy()[positions].tolist()))
+        n_pages = max(1, -(-len(positions) // page_size))
+        if ss.get("m2_page", 1) > n_pages:
+            ss["m2_page"] = n_pages
+        page = st.number_input(f"頁次（共 {n_pages} 頁，{len(positions):,} 個 Persona）", min_value=1, max_value=n_pages, step=1, key="m2_page")
+        # 只渲染目前這一頁；其他頁的勾選狀態保留在 selections 裡
         grid = st.columns(3)
-        for idx, it in enumerate(items):
-            if any(it['name']==r['name'] for r in recs):
-                continue
-            with grid[idx % 3]:
+        for j, pos in enumerate(positions[(page-1)*page_size: page*page_size]):
+            it = items[pos]
+            with grid[j % 3]:
                 st.markdown(f"**{it['name']}**  · 規模：約 {it['size']:,}")
                 st.caption(f"痛點：{it['pain']}｜消費態度：{it['attitudes']}")
-                checked = st.checkbox("選擇此 TA", key=f"m2_all_{idx}", value=(it['name'] in selections))
+                checked = st.checkbox("選擇此 TA", key=f"m2_all_{pos}", value=(it['name'] in selections))
                 if checked:
                     selections.add(it['name']); sizes_map[it['name']] = it['size']
                 else:
                     if it['name'] in selections:
                         selections.discard(it['name']); sizes_map.pop(it['name'], None)
 
-    total_size = sum(sizes_map.get(name, 0) for name in selections)
-    st.info(f"已選 TA：**{len(selections)}** 個｜合計人數：約 **{total_size:,}** 人（示意）")
+    if selections:
+        st.markdown("#### 與已選 TA 相似的 Persona")
+        frame = persona_frame()
+        names = frame["name"].to_numpy(dtype=object)
+        sizes = frame["size"].to_numpy()
+        chosen = np.flatnonzero(np.isin(names, list(selections)))
+        rec_pos = np.flatnonzero(np.isin(names, [r['name'] for r in recs]))
+        sim_cols = st.columns(5)
+        for i, pos in enumerate(similar_personas(persona_similarity(), chosen, sizes, names, k=5, exclude=rec_pos)):
+            it = items[pos]
+            with sim_cols[i % 5]:
+                st.markdown(f"**{it['name']}** · 規模：約 {it['size']:,}")
+                st.caption(f"痛點：{it['pain']}｜消費態度：{it['attitudes']}")
+                if st.checkbox("選擇", key=f"m2_sim_{pos}", value=False):
+                    selections.add(it['name']); sizes_map[it['name']] = it['size']
+
+    # TA 之間會重疊，直接加總會重複計算；以會員母體去重
+    raw_size = sum(sizes_map.get(name, 0) for name in selections)
+    total_size = int(dedup_audience([sizes_map.get(name, 0) for name in selections]))
+    st.info(f"已選 TA：**{len(selections)}** 個｜合計人數（去除重疊）：約 **{total_size:,}** 人（直接加總 {raw_size:,}，示意）")
     st.session_state["selected_ta"] = list(selections)
     st.session_state["selected_ta_sizes"] = sizes_map
 
@@ -567,8 +1117,6 @@ def channel_defaults_from_goal():
         init_m3_channels_from_goal(goal)
     return st.session_state["m3_channel_weights"]
 
-CHANNELS_8 = ["FB","Google","Line","SMS","EDM","APP廣告","APP任務","APP Push"]
-
 def m3_page():
     page_header("渠道與文案製作")
     tabs = st.tabs(["媒體渠道＋文案／圖片","市調出題"])
@@ -652,10 +1200,9 @@ def m3_page():
 
     with tabs[1]:
         st.subheader("虛擬消費者態度（連結選定 TA）")
-        ensure_persona_loaded()
         df = st.session_state.get("persona_df")
         if df is not None and len(st.session_state.get("selected_ta", []))>0:
-            items = normalize_persona(df)
+            items = persona_items()
             pick = [it for it in items if it["name"] in st.session_state["selected_ta"]]
             tags = [it["attitudes"] for it in pick]
             st.write("預估填寫傾向（示意）：")
@@ -1078,6 +1625,8 @@ def main():
         page_login()
         return
 
+    # Persona 目錄來源檔的指紋每次 rerun 只算一次，各頁的 helper 直接用 session 中已載入的目錄
+    ensure_persona_loaded(persona_catalog_stamp())
     global_sidebar_nav()
 
     page = st.session_state.get("current_page", NAV[0])
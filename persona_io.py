@@ -0,0 +1,170 @@
+import os
+import hashlib
+import warnings
+import pandas as pd
+
+# Feather sidecar 需要 pyarrow（streamlit 已相依）；缺少時一律直接讀 xlsx
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except Exception:
+    pa = None
+    feather = None
+
+SIDECAR_SUFFIX = ".feather"
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def sidecar_path(path, sheet_name=0):
+    if sheet_name in (0, None):
+        return path + SIDECAR_SUFFIX
+    return f"{path}.{sheet_name}{SIDECAR_SUFFIX}"
+
+def _source_stamp(stt):
+    return f"{stt.st_mtime_ns}:{stt.st_size}".encode()
+
+def _read_sidecar(side, path, stt):
+    """回傳 (df, 是否需更新 stamp)。mtime/size 相同直接採用；不同時比對 checksum，內容未變就沿用。"""
+    if feather is None or not os.path.exists(side):
+        return None, False
+    try:
+        table = feather.read_table(side, memory_map=True)
+    except Exception:
+        return None, False
+    meta = table.schema.metadata or {}
+    if meta.get(b"source_stamp") == _source_stamp(stt):
+        return table.to_pandas(), False
+    if meta.get(b"source_sha256") == file_sha256(path).encode():
+        return table.to_pandas(), True
+    return None, False
+
+def _write_sidecar(side, df, path, stt):
+    if pa is None:
+        return
+    tmp = f"{side}.{os.getpid()}.tmp"
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b"source_stamp": _source_stamp(stt),
+            b"source_sha256": file_sha256(path).encode(),
+        })
+        feather.write_feather(table, tmp)
+        os.replace(tmp, side)
+    except Exception:
+        # 混合型別欄位無法轉 Arrow、或目錄唯讀：略過 sidecar，不影響載入
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+def read_persona_workbook(path, sheet_name=0):
+    """讀取 Persona workbook；優先使用旁邊的 Feather sidecar，第一次讀 xlsx 時順手寫出 sidecar。"""
+    stt = os.stat(path)
+    side = sidecar_path(path, sheet_name)
+    df, stale = _read_sidecar(side, path, stt)
+    if df is None:
+        df = pd.read_excel(path, sheet_name=sheet_name, engine="openpyxl")
+        stale = True
+    if stale:
+        _write_sidecar(side, df, path, stt)
+    return df
+
+# ---------- 多檔 / 多工作表目錄 ----------
+
+PERSONA_NAME_COLUMNS = ["Persona","名稱","人物","族群","TA","人設"]
+
+def workbook_sheet_names(path):
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def resolve_persona_sources(manifest_path, directory, default_path):
+    """決定 Persona 目錄來源，回傳 [(workbook 路徑, sheets)]；sheets 為 None 代表讀全部工作表。
+
+    優先序：manifest（JSON）> 目錄下所有 xlsx > 單一預設檔。manifest 格式：
+    {"workbooks": [{"path": "personas/clientA.xlsx", "sheets": ["2025Q3"]}, ...]}，
+    也可用 {"directory": "personas"}；相對路徑以 manifest 所在位置為準。
+    manifest 壞掉（JSON 錯誤、缺 path、寫到一半）時發出警告並改用目錄或預設檔，不讓整個 app 掛掉。
+    """
+    if os.path.exists(manifest_path):
+        try:
+            return _manifest_sources(manifest_path)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            warnings.warn(f"Persona manifest {manifest_path} 無法讀取（{e!r}），改用目錄或預設 workbook", stacklevel=2)
+    if directory and os.path.isdir(directory):
+        names = sorted(n for n in os.listdir(directory) if n.endswith(".xlsx") and not n.startswith("~$"))
+        return [(os.path.join(directory, n), None) for n in names]
+    if default_path and os.path.exists(default_path):
+        return [(default_path, (0,))]
+    return []
+
+def _manifest_sources(manifest_path):
+    import json
+    with open(manifest_path, encoding="utf-8") as f:
+        spec = json.load(f)
+    if isinstance(spec, list):
+        spec = {"workbooks": spec}
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    sources = []
+    for ent in spec.get("workbooks", []):
+        if isinstance(ent, str):
+            ent = {"path": ent}
+        sheets = ent.get("sheets")
+        sources.append((os.path.join(base, ent["path"]), tuple(sheets) if sheets else None))
+    if spec.get("directory"):
+        sources += resolve_persona_sources("", os.path.join(base, spec["directory"]), "")
+    return sources
+
+def load_workbook_sheets(path, sheets):
+    """讀單一 workbook 的指定工作表（process pool 的工作單位）；每張表各自走 sidecar。"""
+    if sheets is None:
+        sheets = workbook_sheet_names(path)
+    parts = []
+    for sheet in sheets:
+        df = read_persona_workbook(path, sheet_name=sheet)
+        df["_source"] = f"{os.path.basename(path)}:{sheet}" if sheet != 0 else os.path.basename(path)
+        parts.append(df)
+    return parts
+
+def merge_persona_parts(parts):
+    """合併多張表並依 persona 名稱去重；名稱重複時以來源清單中較後者為準（例如較新的季度）。"""
+    fixed = []
+    for df in parts:
+        name_col = next((c for c in PERSONA_NAME_COLUMNS if c in df.columns), None)
+        if name_col is None and len(df.columns):
+            name_col = df.columns[0]
+        if name_col is not None and name_col != "Persona":
+            df = df.rename(columns={name_col: "Persona"})
+        fixed.append(df)
+    if not fixed:
+        return None
+    merged = pd.concat(fixed, ignore_index=True, sort=False)
+    if "Persona" in merged.columns:
+        merged = merged.drop_duplicates(subset="Persona", keep="last").reset_index(drop=True)
+    return merged
+
+def load_persona_catalog(sources, max_workers=None):
+    """平行讀取多個 workbook（process pool，每個 workbook 一個工作），總耗時約等於最大的那一本。"""
+    if not sources:
+        return None
+    if len(sources) == 1:
+        results = [load_workbook_sheets(*sources[0])]
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # Streamlit server 是多執行緒程序，fork 可能複製到被其他執行緒持有的鎖而卡死（3.12 起也會警告），
+        # 一律用 spawn；工作函式 load_workbook_sheets 在本模組頂層，子程序只需 import persona_io
+        ctx = multiprocessing.get_context("spawn")
+        workers = min(len(sources), max_workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+            results = list(ex.map(load_workbook_sheets, *zip(*sources)))
+    return merge_persona_parts([df for parts in results for df in parts])
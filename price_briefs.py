@@ -0,0 +1,191 @@
+# 命令列批次報價：讀入 RFP brief CSV，逐批計價後輸出 CSV / Parquet（不需啟動 Streamlit）
+#
+#   python price_briefs.py briefs.csv -o quotes.parquet
+#
+# 輸入欄位：brand, industry, goal, budget, start, end，另可給配比：
+#   - mix 欄：'FB:30;Google:70'、'FB=30,Google=70' 或 JSON 物件；
+#   - 或直接以渠道名稱為欄（FB, Google, ...）。
+# 沒有配比的列依 goal 套用 GOAL_TEMPLATES（同媒體提案頁面）。
+import os
+import re
+import sys
+import json
+import argparse
+from collections import deque
+import numpy as np
+import pandas as pd
+from pricing import (
+    GOAL_TEMPLATES, LEGACY_CH_MAP, RATE_CARD_PATH, RESPONSE_CURVES_PATH,
+    active_rate_card, active_response_curves, batch_quote, flight_rates,
+)
+
+DEFAULT_CHUNKSIZE = 5000
+
+def parse_mix(text):
+    """配比字串 -> {渠道: 百分比}；舊版渠道鍵併入標準渠道。空白回傳 None，格式錯誤丟 ValueError。"""
+    text = str(text or "").strip()
+    if not text:
+        return None
+    if text.startswith("{"):
+        raw = json.loads(text)
+    else:
+        raw = {}
+        for part in re.split(r"[;,|]", text):
+            if part.strip():
+                k, v = re.split(r"[:=：]", part, maxsplit=1)
+                raw[k] = v
+    mix = {}
+    for k, v in raw.items():
+        key = LEGACY_CH_MAP.get(str(k).strip(), str(k).strip())
+        mix[key] = mix.get(key, 0.0) + float(v)
+    return mix
+
+def brief_weights(df, channels):
+    """每列的配比矩陣 (N × 渠道數)，以及每列無法計價的配比渠道、其配比合計 (N,) 與錯誤訊息。"""
+    n = len(df)
+    pos = {ch: j for j, ch in enumerate(channels)}
+    goals = df["goal"] if "goal" in df.columns else pd.Series("", index=df.index)
+    templates = np.array([[GOAL_TEMPLATES.get(g, GOAL_TEMPLATES["曝光"]).get(ch, 0) for ch in channels]
+                          for g in [*GOAL_TEMPLATES, ""]], dtype=np.float64)
+    # 未知目標為 -1 -> 最後一列（曝光）
+    goal_id = goals.map({g: i for i, g in enumerate(GOAL_TEMPLATES)}).fillna(-1).astype(np.int64).to_numpy()
+    W = templates[goal_id].copy()
+    unknown = [[] for _ in range(n)]
+    unpriced = np.zeros(n)
+    errors = np.full(n, "", dtype=object)
+
+    ch_cols = [ch for ch in channels if ch in df.columns]
+    if ch_cols:
+        given = df[ch_cols].apply(pd.to_numeric, errors="coerce").fillna(0.0).to_numpy()
+        has = given.sum(axis=1) > 0
+        W[has] = 0.0
+        W[np.ix_(has, [pos[ch] for ch in ch_cols])] = given[has]
+    if "mix" in df.columns:
+        texts = df["mix"].str.strip()
+        # 相同的配比字串只解析一次，再整批寫回對應的列
+        for text, rows in texts.groupby(texts, sort=False).indices.items():
+            if not text:
+                continue
+            try:
+                mix = parse_mix(text)
+            except (ValueError, TypeError):
+                errors[rows] = "配比格式錯誤"
+                continue
+            row = np.zeros(len(channels))
+            extra = []
+            for ch, v in mix.items():
+                if ch in pos:
+                    row[pos[ch]] = v
+                elif v:
+                    extra.append(ch)
+            W[rows] = row
+            unpriced[rows] = sum(mix[ch] for ch in extra)
+            for i in rows:
+                unknown[i] = extra
+    return W, unknown, unpriced, errors
+
+def price_briefs(df, card, curves=None):
+    """一批 brief -> 報價明細與 KPI；依產業分組後以 flight_rates + batch_quote 整批向量化計價。"""
+    n = len(df)
+    channels = card["channels"]
+    budget = pd.to_numeric(df["budget"], errors="coerce") if "budget" in df.columns else pd.Series(np.nan, index=df.index)
+    start = pd.to_datetime(df["start"], errors="coerce")
+    end = pd.to_datetime(df["end"], errors="coerce")
+    W, unknown, unpriced, errors = brief_weights(df, channels)
+    errors[(start.isna() | end.isna()).to_numpy()] = "日期格式錯誤"
+    errors[budget.isna().to_numpy()] = "預算格式錯誤"
+    bad = errors != ""
+
+    starts = start.fillna(pd.Timestamp(card["start"])).to_numpy().astype("datetime64[D]")
+    days = ((end - start).dt.days + 1).fillna(1).clip(lower=1).astype(np.int64).to_numpy()
+    budgets = budget.fillna(0).to_numpy()
+    lacking = np.zeros(W.shape, dtype=bool)
+    out = {key: np.zeros(n, dtype=np.int64 if key in ("報價","轉換") else np.float64) for key in ["報價","CTR","CPA","轉換","ROAS"]}
+    out["明細"] = np.zeros(W.shape, dtype=np.int64)
+    industries = df["industry"] if "industry" in df.columns else pd.Series("", index=df.index)
+    for industry, idx in industries.groupby(industries, sort=False).indices.items():
+        rates = flight_rates(card, starts[idx], days[idx], industry, channels)
+        # 檔期內查不到費率的渠道、以及費率表沒有的配比渠道，不計入報價與 KPI（同 proposal_summary），列在 missing 欄；
+        # NaN 費率直接交給 batch_quote 排除，其配比仍計入總和，成本只算有費率渠道分到的預算
+        lacking[idx] = (W[idx] > 0) & (np.isnan(rates["day_rate"]) | np.isnan(rates["ctr"]) | np.isnan(rates["cpa"]))
+        part = batch_quote(W[idx], days[idx], budgets[idx], channels, unit_ctr=rates["ctr"], unit_cpa=rates["cpa"],
+                           rate_totals=rates["day_rate"], curves=curves, industry=industry, unpriced=unpriced[idx])
+        for key in out:
+            out[key][idx] = part[key]
+    missing = ["、".join([channels[j] for j in np.flatnonzero(lacking[i])] + unknown[i]) for i in range(n)]
+
+    res = df.reset_index(drop=True).copy()
+    res["days"] = np.where(bad, 0, days)
+    res["報價"] = np.where(bad, 0, out["報價"])
+    for j, ch in enumerate(channels):
+        res[f"報價_{ch}"] = np.where(bad, 0, out["明細"][:, j])
+    for key in ["CTR","CPA","轉換","ROAS"]:
+        res[key] = np.where(bad, 0, out[key])
+    res["missing"] = missing
+    res["error"] = errors.astype(str)
+    res["rate_card"] = card["version"]
+    res["response_curves"] = curves["version"] if curves is not None else "linear"
+    return res
+
+def _price_chunk(chunk, rate_card_path, curves_path):
+    # worker 內的費率表與曲線表依檔案指紋快取（lru_cache），每個程序只編譯一次
+    return price_briefs(chunk, active_rate_card(rate_card_path), active_response_curves(curves_path))
+
+def iter_priced_chunks(path, chunksize=DEFAULT_CHUNKSIZE, workers=None, rate_card_path=RATE_CARD_PATH,
+                       curves_path=RESPONSE_CURVES_PATH):
+    """串流讀取輸入檔，每 chunksize 列一批丟給 process pool；同時在途的批次有上限，記憶體不隨檔案大小成長。"""
+    reader = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        for chunk in reader:
+            yield _price_chunk(chunk, rate_card_path, curves_path)
+        return
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    ctx = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        pending = deque()
+        for chunk in reader:
+            pending.append(ex.submit(_price_chunk, chunk, rate_card_path, curves_path))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def write_priced(chunks, out_path):
+    """依副檔名寫出 CSV 或 Parquet（逐批附加，不把全部結果留在記憶體），回傳總列數。"""
+    rows = 0
+    writer = None
+    try:
+        for i, chunk in enumerate(chunks):
+            if out_path.endswith(".parquet"):
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(out_path, table.schema)
+                writer.write_table(table.cast(writer.schema))
+            else:
+                chunk.to_csv(out_path, index=False, mode="w" if i == 0 else "a", header=(i == 0))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="批次計算 RFP brief 的報價與預估成效")
+    ap.add_argument("input", help="brief CSV（brand, industry, goal, budget, start, end[, mix]）")
+    ap.add_argument("-o", "--output", required=True, help="輸出檔，副檔名 .csv 或 .parquet")
+    ap.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="每批列數")
+    ap.add_argument("--workers", type=int, default=None, help="worker 程序數（預設為 CPU 數，1 為不開 process pool）")
+    ap.add_argument("--rate-card", default=RATE_CARD_PATH, help="費率表 CSV")
+    ap.add_argument("--response-curves", default=RESPONSE_CURVES_PATH, help="反應曲線 CSV（檔案不存在時為線性估算）")
+    args = ap.parse_args(argv)
+    rows = write_priced(iter_priced_chunks(args.input, args.chunksize, args.workers, args.rate_card, args.response_curves),
+                        args.output)
+    print(f"{rows:,} briefs -> {args.output}（費率表 {active_rate_card(args.rate_card)['version']}）", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,753 @@
+# 提案報價與成效估算：費率表、批次計價、最佳化、Monte Carlo、觸及／頻次、報價快取。
+# 不相依 Streamlit，app.py 與命令列批次報價（price_briefs.py）共用同一份計價邏輯。
+import os
+import re
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# ---------- Helper: KPI & Pricing (簡化估算 for M1) ----------
+
+UNIT_CTR = {"FB":1.2,"Google":2.2,"Line":1.0,"SMS":0.8,"EDM":1.0,"APP廣告":1.1,"APP任務":0.9,"APP Push":1.3}
+UNIT_CPA = {"FB":140,"Google":110,"Line":160,"SMS":180,"EDM":170,"APP廣告":150,"APP任務":190,"APP Push":160}
+
+DAY_RATE = {
+    "FB":28000, "Google":32000, "Line":22000, "SMS":15000,
+    "EDM":18000, "APP廣告":26000, "APP任務":20000, "APP Push":17000
+}
+
+AVG_ORDER_VALUE = 300  # ROAS 估算用的平均客單價
+
+def estimate_by_mix(budget, mix, unit_ctr=None, unit_cpa=None, curves=None, industry=None, days=1):
+    # curves（見 active_response_curves）給定時，各渠道 CPA 依每日花費套用邊際遞減：有效 CPA = CPA / m
+    # unit_ctr / unit_cpa 查不到的渠道不計入成效（不套用預設值），成本只算有費率的渠道分到的預算
+    if unit_ctr is None:
+        unit_ctr = UNIT_CTR
+    if unit_cpa is None:
+        unit_cpa = UNIT_CPA
+    total = sum((mix or {}).values())
+    known = {k: v for k, v in (mix or {}).items() if v and k in unit_ctr and k in unit_cpa}
+    if total == 0 or not known:
+        return {"CTR":0,"CPA":0,"轉換":0,"ROAS":0,"成本":0}
+    known_total = sum(known.values())
+    cost = budget if known_total == total else budget * known_total / total
+    w = {k:v/known_total for k,v in known.items()}
+    ctr = sum(unit_ctr[k]*w[k] for k in w)
+    if curves is None:
+        cpa = sum(unit_cpa[k]*w[k] for k in w)
+    else:
+        keys = list(w)
+        m = saturation(curves, np.array([budget*known[k]/total/max(days, 1) for k in keys]), industry, keys)
+        cpa = float(sum(unit_cpa[k]/m[i]*w[k] for i, k in enumerate(keys)))
+    conv = int(max(cost/cpa, 0))
+    roas = round((conv*AVG_ORDER_VALUE)/cost, 2) if cost>0 else 0
+    return {"CTR":round(ctr,2), "CPA":round(cpa,2), "轉換":conv, "ROAS":roas, "成本":cost}
+
+def quote_by_days_and_mix(days, mix, day_rate=None):
+    if day_rate is None:
+        day_rate = DAY_RATE
+    if not mix or sum(mix.values()) == 0:
+        return 0, {}
+    # 查不到日費率的渠道不計價（同 quote_flight），不套用預設值
+    breakdown = {ch: round(days * day_rate[ch] * (pct/100)) for ch, pct in mix.items() if ch in day_rate}
+    return int(sum(breakdown.values())), breakdown
+
+# ---------- Batch pricing（多組配比一次向量化估算） ----------
+
+def rate_vector(table, default=np.nan, channels=None):
+    """費率 dict 或逐列陣列 (N × 渠道數，例如 flight_rates 的 ctr/cpa) -> 依 channels 排列的陣列；查不到的為 default（預設 NaN）。"""
+    channels = channels or CHANNELS_8
+    if isinstance(table, np.ndarray):
+        return np.where(np.isnan(table), default, table)
+    return np.array([table.get(ch, default) for ch in channels], dtype=np.float64)
+
+def mix_matrix(mixes, channels=None):
+    """[{渠道: 百分比}, ...] -> (N × 渠道數) 陣列，欄位順序同 channels（預設 CHANNELS_8）。"""
+    channels = channels or CHANNELS_8
+    return np.array([[float(m.get(ch, 0)) for ch in channels] for m in mixes], dtype=np.float64).reshape(len(mixes), len(channels))
+
+def batch_quote(weights, days, budgets, channels=None, day_rate=None, unit_ctr=None, unit_cpa=None, rate_totals=None,
+                curves=None, industry=None, unpriced=None):
+    """一次估算 N 組提案：weights 為 (N × 渠道數) 百分比（同滑桿），days/budgets 為 (N,) 或純量。
+
+    與 quote_by_days_and_mix / estimate_by_mix 的結果一致，但全部以陣列回傳：
+    報價 (N,)、明細 (N × 渠道數)、CTR、CPA、轉換、ROAS、成本 (N,)。
+    rate_totals 為各檔期的逐日費率總和 (N × 渠道數，見 flight_rates)；給定時取代 days × day_rate。
+    unit_ctr / unit_cpa 可為 dict，或逐列的 (N × 渠道數) 陣列。
+    查不到日費率、CTR 或 CPA（dict 沒有、陣列為 NaN）的渠道不計入報價與成效，成本只算有費率渠道分到的預算。
+    unpriced (N,) 為不在 channels 內的配比合計（例如費率表沒有的渠道），只計入配比總和。
+    curves 給定時依各渠道每日花費查表套用邊際遞減（同 estimate_by_mix）。
+    """
+    channels = channels or CHANNELS_8
+    W = np.asarray(weights, dtype=np.float64).reshape(-1, len(channels))
+    n = W.shape[0]
+    days = np.broadcast_to(np.asarray(days, dtype=np.float64), (n,))
+    budgets = np.broadcast_to(np.asarray(budgets, dtype=np.float64), (n,))
+    r = rate_vector(DAY_RATE if day_rate is None else day_rate, channels=channels)
+    ctr_v = rate_vector(UNIT_CTR if unit_ctr is None else unit_ctr, channels=channels)
+    cpa_v = rate_vector(UNIT_CPA if unit_cpa is None else unit_cpa, channels=channels)
+
+    total = W.sum(axis=1)
+    if unpriced is not None:
+        total = total + np.asarray(unpriced, dtype=np.float64)
+    valid = total > 0
+    totals = days[:, None] * r if rate_totals is None else np.broadcast_to(np.asarray(rate_totals, dtype=np.float64), W.shape)
+    known = ~np.isnan(totals) & ~np.isnan(np.broadcast_to(ctr_v, W.shape)) & ~np.isnan(np.broadcast_to(cpa_v, W.shape))
+    Wk = np.where(known, W, 0.0)
+    breakdown = np.round(np.where(known, totals, 0.0) * (Wk / 100)).astype(np.int64)
+    breakdown[~valid] = 0
+    known_total = Wk.sum(axis=1)
+    share = np.divide(W, total[:, None], out=np.zeros_like(W), where=valid[:, None])
+    kshare = np.divide(Wk, known_total[:, None], out=np.zeros_like(W), where=known_total[:, None] > 0)
+    cost = np.where(known_total == total, budgets, budgets * np.divide(known_total, total, out=np.zeros(n), where=valid))
+    ctr_v = np.where(known, ctr_v, 0.0)
+    cpa_v = np.where(known, cpa_v, 0.0)
+    if curves is not None:
+        cpa_v = cpa_v / saturation(curves, budgets[:, None] * share / np.maximum(days, 1)[:, None], industry, channels)
+    # 依渠道順序逐欄累加（與 estimate_by_mix 的加總順序相同，四捨五入結果才會一致）
+    ctr = np.zeros(n)
+    cpa = np.zeros(n)
+    for j in range(len(channels)):
+        ctr += ctr_v[:, j] * kshare[:, j]
+        cpa += cpa_v[:, j] * kshare[:, j]
+    conv = np.floor(np.maximum(np.divide(cost, cpa, out=np.zeros(n), where=cpa > 0), 0)).astype(np.int64)
+    roas = np.round(np.divide(conv * AVG_ORDER_VALUE, cost, out=np.zeros(n), where=cost > 0), 2)
+    return {
+        "channels": list(channels),
+        "報價": breakdown.sum(axis=1),
+        "明細": breakdown,
+        "CTR": np.round(ctr, 2),
+        "CPA": np.round(cpa, 2),
+        "轉換": conv,
+        "ROAS": roas,
+        "成本": np.where(known_total > 0, cost, 0),
+    }
+
+# ---------- What-if 敏感度網格（預算 × 檔期天數） ----------
+
+def sensitivity_grid(mix, budgets, day_counts, rate_totals=None, unit_ctr=None, unit_cpa=None, curves=None, industry=None):
+    """目前配比在 budgets × day_counts 網格上的報價與預估轉換；整個網格一次送進 batch_quote。
+
+    rate_totals 為 (len(day_counts) × 渠道數) 的逐日費率總和（同一開始日、不同天數），用於依費率表計價。
+    """
+    channels = list(mix or {})
+    budgets = np.asarray(budgets, dtype=np.float64)
+    day_counts = np.asarray(day_counts, dtype=np.float64)
+    B, D = np.meshgrid(budgets, day_counts, indexing="ij")
+    W = np.broadcast_to(mix_matrix([mix or {}], channels), (B.size, len(channels)))
+    if rate_totals is not None:
+        rate_totals = np.tile(np.asarray(rate_totals, dtype=np.float64), (len(budgets), 1))
+    out = batch_quote(W, D.ravel(), B.ravel(), channels, unit_ctr=unit_ctr, unit_cpa=unit_cpa, rate_totals=rate_totals,
+                      curves=curves, industry=industry)
+    return pd.DataFrame({
+        "預算": B.ravel().astype(np.int64),
+        "天數": D.ravel().astype(np.int64),
+        "報價": out["報價"],
+        "轉換": out["轉換"],
+    })
+
+# ---------- Monte Carlo 不確定區間 ----------
+
+MC_SCENARIOS = 100_000
+MC_CTR_CV = 0.25   # 各渠道 CTR 的變異係數（對數常態，平均值 = 費率表）
+MC_CPA_CV = 0.20   # 各渠道 CPA 的變異係數
+
+def _lognormal_params(mean, cv):
+    sigma = np.sqrt(np.log1p(cv**2))
+    return np.log(mean) - sigma**2 / 2, sigma
+
+def simulate_mix_kpis(budget, mix, days, n=MC_SCENARIOS, seed=2025, ctr_cv=MC_CTR_CV, cpa_cv=MC_CPA_CV, channels=None,
+                      unit_ctr=None, unit_cpa=None, curves=None, industry=None):
+    """以對數常態分佈一次抽出 n 組各渠道 CTR/CPA 情境，回傳各 KPI 的 P10/P50/P90。
+
+    curves 給定時，CPA 的平均值為依每日花費（預算 × 配比 / days）套用邊際遞減後的有效 CPA。
+    """
+    # 與 estimate_by_mix 相同：查不到 CTR/CPA 的渠道不計入，成本只算有費率渠道分到的預算
+    channels = channels or list(mix or {})
+    w = mix_matrix([mix or {}], channels)[0]
+    ctr_mean = rate_vector(UNIT_CTR if unit_ctr is None else unit_ctr, channels=channels)
+    cpa_mean = rate_vector(UNIT_CPA if unit_cpa is None else unit_cpa, channels=channels)
+    used = (w > 0) & ~np.isnan(ctr_mean) & ~np.isnan(cpa_mean)
+    if w.sum() <= 0 or not used.any():
+        return {}
+    share = w / w.sum()
+    cost = budget * share[used].sum()
+    wk = share[used] / share[used].sum()
+    rng = np.random.default_rng(seed)
+    mu, sig = _lognormal_params(ctr_mean[used], ctr_cv)
+    ctr = np.exp(mu + sig * rng.standard_normal((n, int(used.sum())))) @ wk
+    if curves is not None:
+        cpa_mean = cpa_mean / saturation(curves, budget * share / max(int(days), 1), industry, channels)
+    mu, sig = _lognormal_params(cpa_mean[used], cpa_cv)
+    cpa = np.exp(mu + sig * rng.standard_normal((n, int(used.sum())))) @ wk
+    conv = np.floor(np.maximum(cost / cpa, 0))
+    roas = conv * AVG_ORDER_VALUE / cost if cost > 0 else np.zeros(n)
+    pct = lambda x, nd: tuple(round(float(v), nd) for v in np.percentile(x, [10, 50, 90]))
+    return {"CTR": pct(ctr, 2), "CPA": pct(cpa, 2), "轉換": tuple(int(v) for v in np.percentile(conv, [10, 50, 90])), "ROAS": pct(roas, 2)}
+
+# ---------- Channel-mix optimizer（預算限制下的最佳配比） ----------
+
+def _fill_by_priority(key, lo, hi, total=100):
+    """從下限出發，依 key 由小到大把剩餘百分比填到上限。"""
+    w = lo.copy()
+    rem = total - int(lo.sum())
+    for i in np.argsort(key, kind="stable"):
+        add = min(int(hi[i] - w[i]), rem)
+        w[i] += add
+        rem -= add
+        if rem == 0:
+            break
+    return w
+
+def _mix_objective(out, goal):
+    # 曝光：以去重觸及人數為目標；名單/購買：以轉換數為目標
+    return out["觸及"].astype(np.float64) if goal == "曝光" else out["轉換"].astype(np.float64)
+
+def optimize_mix(budget, days, goal, lo=None, hi=None, channels=None, top_n=3,
+                 day_rate=None, unit_ctr=None, unit_cpa=None, max_iter=500, curves=None, industry=None,
+                 sizes=None, affinity=None, unit_cpm=None):
+    """在 報價 ≤ 預算、各渠道 最低% ≤ 配比 ≤ 最高%、合計 100% 下，找出目標（轉換或觸及）最佳的整數配比。
+
+    曝光目標以 batch_reach 估算的去重觸及人數為目標（sizes / affinity 同 reach_frequency；未給時視為
+    整個會員母體、各渠道可觸及比例相同）；名單、購買以預估轉換數為目標。
+    查不到日費率、CTR 或 CPA 的渠道上限視為 0%（不會被配到預算）；若其下限 > 0 則無可行解。
+
+    先以 Lagrange 乘數二分法解連續 LP 取得起點，再用兩兩渠道移轉的鄰域搜尋（每輪全部鄰居
+    一次丟給 batch_quote）微調；搜尋過程中評估過的可行解依目標排序後回傳，第一筆為最佳解，
+    其餘為次佳方案。無可行解時回傳空 list。
+    """
+    channels = channels or CHANNELS_8
+    c = len(channels)
+    lo = np.array([int((lo or {}).get(ch, 0)) for ch in channels], dtype=np.int64)
+    hi = np.array([int((hi or {}).get(ch, 100)) for ch in channels], dtype=np.int64)
+    days = max(int(days), 1)
+    r = rate_vector(DAY_RATE if day_rate is None else day_rate, channels=channels)
+    priced = (~np.isnan(r) & ~np.isnan(rate_vector(UNIT_CTR if unit_ctr is None else unit_ctr, channels=channels))
+              & ~np.isnan(rate_vector(UNIT_CPA if unit_cpa is None else unit_cpa, channels=channels)))
+    hi[~priced] = 0
+    r = np.nan_to_num(r)
+    if (lo > hi).any() or lo.sum() > 100 or hi.sum() < 100:
+        return []
+    if goal == "曝光" and sizes is None:
+        sizes, affinity = [REACH_UNIVERSE], np.full((1, c), REACH_AFFINITY_BASE)
+
+    def price(W):
+        out = batch_quote(W, days, budget, channels, day_rate, unit_ctr, unit_cpa, curves=curves, industry=industry)
+        if goal == "曝光":
+            out.update(batch_reach(W, budget, sizes, affinity, channels, unit_cpm))
+        return out
+    if price(_fill_by_priority(r, lo, hi)[None, :])["報價"][0] > budget:
+        return []
+
+    # 連續 LP 起點：minimize cost + λ·rate，λ 二分到剛好不超出預算
+    out0 = price(np.eye(c) * 100)
+    cost = -out0["觸及"] if goal == "曝光" else out0["CPA"]
+    cost = cost / max(np.abs(cost).max(), 1e-9)
+    r_norm = r / max(r.max(), 1e-9)
+    w = _fill_by_priority(cost, lo, hi)
+    if price(w[None, :])["報價"][0] > budget:
+        lam_lo, lam_hi = 0.0, 1.0
+        while price(_fill_by_priority(cost + lam_hi * r_norm, lo, hi)[None, :])["報價"][0] > budget:
+            lam_hi *= 2
+        for _ in range(40):
+            mid = (lam_lo + lam_hi) / 2
+            if price(_fill_by_priority(cost + mid * r_norm, lo, hi)[None, :])["報價"][0] > budget:
+                lam_lo = mid
+            else:
+                lam_hi = mid
+        w = _fill_by_priority(cost + lam_hi * r_norm, lo, hi)
+
+    # 鄰域搜尋：把 step% 從 i 移到 j
+    pairs = np.array([(i, j) for i in range(c) for j in range(c) if i != j], dtype=np.int64)
+    seen = {}
+    def evaluate(W):
+        out = price(W)
+        ok = out["報價"] <= budget
+        obj = _mix_objective(out, goal)
+        for k in np.flatnonzero(ok):
+            seen.setdefault(tuple(W[k].tolist()), (float(obj[k]), int(out["報價"][k])))
+        return obj, out["報價"], ok
+    obj, quote, _ = evaluate(w[None, :])
+    best = (obj[0], -quote[0])
+    for step in (10, 5, 2, 1):
+        for _ in range(max_iter):
+            W = np.repeat(w[None, :], len(pairs), axis=0)
+            W[np.arange(len(pairs)), pairs[:, 0]] -= step
+            W[np.arange(len(pairs)), pairs[:, 1]] += step
+            W = W[((W >= lo) & (W <= hi)).all(axis=1)]
+            if not len(W):
+                break
+            obj, quote, ok = evaluate(W)
+            if not ok.any():
+                break
+            cand = np.flatnonzero(ok)
+            k = cand[np.lexsort((quote[cand], -obj[cand]))[0]]
+            if (obj[k], -quote[k]) <= best:
+                break
+            best, w = (obj[k], -quote[k]), W[k]
+
+    ranked = sorted(seen.items(), key=lambda kv: (-kv[1][0], kv[1][1], kv[0]))[:top_n]
+    W = np.array([m for m, _ in ranked], dtype=np.float64)
+    out = price(W)
+    return [{
+        "mix": dict(zip(channels, (int(v) for v in W[k]))),
+        "報價": int(out["報價"][k]),
+        "CTR": float(out["CTR"][k]),
+        "CPA": float(out["CPA"][k]),
+        "轉換": int(out["轉換"][k]),
+        "ROAS": float(out["ROAS"][k]),
+        **({"觸及": int(out["觸及"][k]), "曝光": int(out["曝光"][k])} if goal == "曝光" else {}),
+    } for k in range(len(W))]
+
+# ---------- Rate cards（版本化、依生效日期的費率表） ----------
+
+RATE_CARD_PATH = os.path.join(".", "rate_cards.csv")
+RATE_CARD_COLUMNS = ["version","effective_from","effective_to","channel","industry","day_rate","ctr","cpa"]
+RATE_CARD_FIELDS = ["day_rate","ctr","cpa"]
+RATE_CARD_HORIZON = 3 * 365  # 表內最後日期之後再展開的天數；未填結束日的列會一路延續，超出後沿用最後一天
+
+def builtin_rate_card_table():
+    """以程式內建的 DAY_RATE / UNIT_CTR / UNIT_CPA 組成費率表（找不到 rate_cards.csv 時使用）。"""
+    return pd.DataFrame({
+        "version": "builtin", "effective_from": "2000-01-01", "effective_to": "",
+        "channel": CHANNELS_8, "industry": "",
+        "day_rate": [DAY_RATE[ch] for ch in CHANNELS_8],
+        "ctr": [UNIT_CTR[ch] for ch in CHANNELS_8],
+        "cpa": [UNIT_CPA[ch] for ch in CHANNELS_8],
+    })
+
+def load_rate_card_table(path=RATE_CARD_PATH):
+    """讀取費率表：每列為 (版本, 生效起日, 生效迄日, 渠道, 產業, 日費率, CTR, CPA)。
+
+    迄日留空代表持續有效；產業留空代表通用；數值欄留空代表該列不覆寫此欄位。
+    """
+    try:
+        table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return builtin_rate_card_table()
+    table = table.reindex(columns=RATE_CARD_COLUMNS, fill_value="")
+    for col in ["version","channel","industry"]:
+        table[col] = table[col].str.strip()
+    for col in RATE_CARD_FIELDS:
+        table[col] = pd.to_numeric(table[col], errors="coerce")
+    return table[table["channel"] != ""].reset_index(drop=True)
+
+def compile_rate_card(table, horizon=RATE_CARD_HORIZON):
+    """把費率表編成以 (產業, 日, 渠道 id) 索引的密集陣列，第 0 層為通用費率。
+
+    重疊的列依生效起日排序，較晚者覆蓋較早者；產業專屬列在通用列之後套用，只覆蓋該產業那一層。
+    另存各欄位沿日期的前綴和與「有費率的天數」前綴和，任意檔期的總額只需兩次查表。
+    """
+    t = table.copy()
+    t["effective_from"] = pd.to_datetime(t["effective_from"], errors="coerce")
+    t["effective_to"] = pd.to_datetime(t["effective_to"], errors="coerce")
+    t = t.dropna(subset=["effective_from"])
+    if t.empty:
+        return compile_rate_card(builtin_rate_card_table(), horizon)
+
+    channels = list(dict.fromkeys(CHANNELS_8 + t["channel"].tolist()))
+    industries = [""] + sorted(set(t["industry"]) - {""})
+    channel_id = {ch: i for i, ch in enumerate(channels)}
+    industry_id = {ind: i for i, ind in enumerate(industries)}
+    start = t["effective_from"].min().normalize()
+    last = max(t["effective_from"].max(), t["effective_to"].max() if t["effective_to"].notna().any() else start)
+    n_days = (last - start).days + 1 + horizon
+
+    t["d0"] = (t["effective_from"] - start).dt.days
+    t["d1"] = ((t["effective_to"] - start).dt.days + 1).fillna(n_days).astype(np.int64)
+    t["specific"] = t["industry"] != ""
+    t = t.sort_values(["specific","effective_from"], kind="stable")
+    shape = (len(industries), n_days, len(channels))
+    rates = {f: np.full(shape, np.nan) for f in RATE_CARD_FIELDS}
+    for row in t.itertuples(index=False):
+        layer = industry_id[row.industry] if row.specific else slice(None)
+        for f in RATE_CARD_FIELDS:
+            v = getattr(row, f)
+            if not np.isnan(v):
+                rates[f][layer, row.d0:row.d1, channel_id[row.channel]] = v
+
+    cum, known, tail, known_tail = {}, {}, {}, {}
+    zeros = np.zeros((len(industries), 1, len(channels)))
+    for f in RATE_CARD_FIELDS:
+        ok = ~np.isnan(rates[f])
+        cum[f] = np.concatenate([zeros, np.cumsum(np.where(ok, rates[f], 0.0), axis=1)], axis=1)
+        known[f] = np.concatenate([zeros, np.cumsum(ok, axis=1)], axis=1)
+        tail[f] = np.where(ok[:, -1], rates[f][:, -1], 0.0)
+        known_tail[f] = ok[:, -1].astype(np.float64)
+
+    newest = t.loc[t["effective_from"].idxmax(), "version"] or "unversioned"
+    digest = hashlib.sha256(pd.util.hash_pandas_object(table, index=False).to_numpy().tobytes()).hexdigest()[:8]
+    return {
+        "version": f"{newest}@{digest}",
+        "start": np.datetime64(start.date(), "D"),
+        "n_days": n_days,
+        "channels": channels,
+        "channel_id": channel_id,
+        "industries": industries,
+        "industry_id": industry_id,
+        "rates": rates,
+        "cum": cum, "known": known, "tail": tail, "known_tail": known_tail,
+    }
+
+def rate_card_stamp(path=RATE_CARD_PATH):
+    try:
+        stt = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.abspath(path), stt.st_mtime_ns, stt.st_size)
+
+@functools.lru_cache(maxsize=4)
+def _compiled_rate_card(stamp):
+    return compile_rate_card(load_rate_card_table(stamp[0]) if stamp else builtin_rate_card_table())
+
+def active_rate_card(path=RATE_CARD_PATH):
+    """目前生效的費率表；以檔案 (mtime, size) 為鍵，覆蓋 rate_cards.csv 後下一次計價即改用新表，不需重啟。"""
+    return _compiled_rate_card(rate_card_stamp(path))
+
+def _range_sum(cum, tail, s, e):
+    # cum: (天數+1, 渠道數) 前綴和；回傳每個 [s, e) 區間的總和。表尾之後的天數沿用最後一天，表頭之前視為 0
+    n_days = cum.shape[0] - 1
+    total = cum[np.clip(e, 0, n_days)] - cum[np.clip(s, 0, n_days)]
+    after = np.clip(e - np.maximum(s, n_days), 0, None)
+    return total + after[:, None] * tail
+
+def flight_rates(card, starts, days, industry=None, channels=None):
+    """N 個檔期（開始日 starts、天數 days，可為純量或陣列）在費率表上的逐日查表結果。
+
+    回傳 dict：day_rate 為檔期內每日費率的總和，ctr / cpa 為檔期內的日平均，皆為 (N × 渠道數)；
+    檔期內有任何一天查不到費率的渠道為 NaN，由呼叫端決定如何提示，不再默默套用預設值。
+    """
+    channels = channels or CHANNELS_8
+    starts = np.atleast_1d(np.asarray(starts, dtype="datetime64[D]"))
+    s = (starts - card["start"]).astype(np.int64)
+    days = np.broadcast_to(np.maximum(np.asarray(days, dtype=np.int64), 1), s.shape)
+    e = s + days
+    layer = card["industry_id"].get(industry or "", 0)
+    cols = np.array([card["channel_id"].get(ch, -1) for ch in channels], dtype=np.int64)
+    out = {}
+    for f in RATE_CARD_FIELDS:
+        total = _range_sum(card["cum"][f][layer], card["tail"][f][layer], s, e)
+        known = _range_sum(card["known"][f][layer], card["known_tail"][f][layer], s, e)
+        total = np.where(known >= days[:, None], total, np.nan)
+        res = np.full((len(s), len(channels)), np.nan)
+        res[:, cols >= 0] = total[:, cols[cols >= 0]]
+        # CTR/CPA 的日平均由前綴和相減而來，先去掉浮點尾差，避免 budget/CPA 取整時差 1
+        out[f] = res if f == "day_rate" else np.round(res / days[:, None], 6)
+    return out
+
+def flight_rate_tables(card, start, days, industry=None, channels=None):
+    """單一檔期的費率 dict（日費率為檔期平均），可直接傳給 estimate_by_mix / optimize_mix；查不到的渠道不列入。"""
+    channels = channels or CHANNELS_8
+    rates = flight_rates(card, start, days, industry, channels)
+    per_day = {"day_rate": rates["day_rate"][0] / max(int(days), 1), "ctr": rates["ctr"][0], "cpa": rates["cpa"][0]}
+    return {f: {ch: float(v) for ch, v in zip(channels, vals) if not np.isnan(v)} for f, vals in per_day.items()}
+
+def quote_flight(start, days, mix, industry=None, card=None):
+    """依費率表逐日計價的檔期報價，回傳 (報價, 明細, 缺少費率的渠道)；檔期跨費率異動時各段分別計價。
+
+    費率固定時結果與 quote_by_days_and_mix 相同；缺少費率的渠道不計入報價，改由 missing 回報。
+    """
+    card = card or active_rate_card()
+    if not mix or sum(mix.values()) == 0:
+        return 0, {}, []
+    channels = list(mix)
+    totals = flight_rates(card, start, days, industry, channels)["day_rate"][0]
+    breakdown, missing = {}, []
+    for ch, total in zip(channels, totals):
+        pct = mix[ch]
+        if np.isnan(total):
+            if pct > 0:
+                missing.append(ch)
+            continue
+        breakdown[ch] = round(total * (pct/100))
+    return int(sum(breakdown.values())), breakdown, missing
+
+# ---------- Response curves（各渠道邊際遞減，預先算成查表） ----------
+
+RESPONSE_CURVES_PATH = os.path.join(".", "response_curves.csv")
+RESPONSE_CURVE_COLUMNS = ["channel","industry","curve","half_sat","hill"]
+RESPONSE_GRID_MIN = 1e2    # 每日花費網格下限（TWD）
+RESPONSE_GRID_MAX = 1e9    # 每日花費網格上限（TWD）
+RESPONSE_GRID_POINTS = 1024
+RESPONSE_HILL_MAX = 10.0   # hill 形狀參數的合理範圍 (0, RESPONSE_HILL_MAX]，範圍外的列在讀檔時捨棄
+
+def saturation_multiplier(curve, daily_spend, half_sat, hill=1.0):
+    """有效轉換 / 線性轉換（= CPA / 有效 CPA），x = 每日花費 / half_sat；回傳值在 (0, 1]，隨花費遞減。
+
+    hill：conv ∝ x / (1 + x^a)^(1/a)，起點斜率即費率表 CPA，花費越高越趨近上限 half_sat 的轉換；
+          a 控制轉彎的銳利度（a = 1 時 x = 1 為線性估算的一半），任何 a > 0 轉換都隨花費單調遞增。
+    log ：conv ∝ ln(1 + x)，起點斜率即費率表 CPA，之後以對數遞減。
+    """
+    x = np.maximum(np.asarray(daily_spend, dtype=np.float64), 1e-12) / half_sat
+    if curve == "log":
+        m = np.log1p(x) / x
+    else:
+        # (1 + x^a)^(-1/a) 以 logaddexp 計算，x 很大時不會溢位
+        m = np.exp(-np.logaddexp(0.0, hill * np.log(x)) / hill)
+    return np.clip(m, np.finfo(np.float64).tiny, 1.0)
+
+def load_response_curve_table(path=RESPONSE_CURVES_PATH):
+    """讀取曲線參數：每列為 (渠道, 產業, 曲線 hill|log, half_sat 每日花費, hill 形狀)；產業留空代表通用。
+
+    hill 留空為 1；half_sat ≤ 0 或 hill 不在 (0, RESPONSE_HILL_MAX] 的列捨棄。
+    """
+    try:
+        table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return pd.DataFrame(columns=RESPONSE_CURVE_COLUMNS)
+    table = table.reindex(columns=RESPONSE_CURVE_COLUMNS, fill_value="")
+    for col in ["channel","industry","curve"]:
+        table[col] = table[col].str.strip()
+    table["curve"] = table["curve"].str.lower().replace("", "hill")
+    table["half_sat"] = pd.to_numeric(table["half_sat"], errors="coerce")
+    table["hill"] = pd.to_numeric(table["hill"].str.strip().replace("", "1"), errors="coerce")
+    ok = (table["channel"] != "") & (table["half_sat"] > 0) & (table["hill"] > 0) & (table["hill"] <= RESPONSE_HILL_MAX)
+    return table[ok].reset_index(drop=True)
+
+def compile_response_curves(table):
+    """把曲線參數展開成 (產業, 渠道, 花費網格) 的倍數表，網格為對數等距；沒有曲線的渠道倍數為 1（線性）。
+
+    產業專屬列在通用列之後套用，只覆蓋該產業那一層。
+    """
+    channels = list(dict.fromkeys(CHANNELS_8 + table["channel"].tolist()))
+    industries = [""] + sorted(set(table["industry"]) - {""})
+    channel_id = {ch: i for i, ch in enumerate(channels)}
+    industry_id = {ind: i for i, ind in enumerate(industries)}
+    grid = np.geomspace(RESPONSE_GRID_MIN, RESPONSE_GRID_MAX, RESPONSE_GRID_POINTS)
+    mult = np.ones((len(industries), len(channels), RESPONSE_GRID_POINTS))
+    t = table.assign(specific=table["industry"] != "").sort_values("specific", kind="stable")
+    for row in t.itertuples(index=False):
+        layer = industry_id[row.industry] if row.specific else slice(None)
+        mult[layer, channel_id[row.channel]] = saturation_multiplier(row.curve, grid, row.half_sat, row.hill)
+    digest = hashlib.sha256(pd.util.hash_pandas_object(table, index=False).to_numpy().tobytes()).hexdigest()[:8]
+    return {
+        "version": f"curves@{digest}" if len(table) else "linear",
+        "channels": channels,
+        "channel_id": channel_id,
+        "industry_id": industry_id,
+        "log_min": np.log(RESPONSE_GRID_MIN),
+        "log_step": np.log(RESPONSE_GRID_MAX / RESPONSE_GRID_MIN) / (RESPONSE_GRID_POINTS - 1),
+        "mult": mult,
+    }
+
+@functools.lru_cache(maxsize=4)
+def _compiled_response_curves(stamp):
+    return compile_response_curves(load_response_curve_table(stamp[0]) if stamp else load_response_curve_table(""))
+
+def active_response_curves(path=RESPONSE_CURVES_PATH):
+    """目前生效的曲線表；同費率表，以檔案指紋為鍵，改檔後下一次計價即套用。"""
+    return _compiled_response_curves(rate_card_stamp(path))
+
+def saturation(curves, daily_spend, industry=None, channels=None):
+    """daily_spend (… × 渠道數) -> 倍數 m ∈ (0, 1]（有效 CPA = CPA / m）。
+
+    以對數等距網格直接算出索引再線性內插，每個值 O(1)；網格外取端點值。
+    """
+    channels = channels or CHANNELS_8
+    layer = curves["mult"][curves["industry_id"].get(industry or "", 0)]
+    cols = np.array([curves["channel_id"].get(ch, -1) for ch in channels], dtype=np.int64)
+    # 費率表以外的渠道沒有曲線，補一列 1（線性）
+    table = np.vstack([layer, np.ones((1, layer.shape[1]))])[cols]
+    spend = np.asarray(daily_spend, dtype=np.float64)
+    pos = (np.log(np.clip(spend, RESPONSE_GRID_MIN, RESPONSE_GRID_MAX)) - curves["log_min"]) / curves["log_step"]
+    i0 = np.clip(np.floor(pos).astype(np.int64), 0, RESPONSE_GRID_POINTS - 2)
+    frac = pos - i0
+    col = np.broadcast_to(np.arange(len(channels)), spend.shape)
+    return table[col, i0] * (1 - frac) + table[col, i0 + 1] * frac
+
+# ---------- Reach / Frequency（跨渠道、跨 TA 去重的觸及與平均頻次） ----------
+
+REACH_UNIVERSE = 11_000_000   # 會員母體；TA 之間的重疊以此為基準去重（假設各 TA 在母體中獨立分佈）
+UNIT_CPM = {"FB":180,"Google":150,"Line":220,"SMS":700,"EDM":60,"APP廣告":160,"APP任務":300,"APP Push":40}  # 每千次曝光（則）成本
+REACH_AFFINITY_HIT = 0.9      # persona 的偏好版位提到該渠道時，其成員可被該渠道觸及的比例
+REACH_AFFINITY_BASE = 0.3     # 其他渠道
+CHANNEL_SLOT_ALIASES = {
+    "FB": ["fb","facebook","ig","instagram","臉書"],
+    "Google": ["google","youtube","yt","搜尋"],
+    "Line": ["line"],
+    "SMS": ["sms","簡訊"],
+    "EDM": ["edm","email","e-mail","電子報"],
+    "APP廣告": ["app廣告","app 廣告","開屏","banner"],
+    "APP任務": ["app任務","app 任務","任務"],
+    "APP Push": ["push","推播"],
+}
+
+def channel_slot_mask(slots, channels=None):
+    """偏好版位文字 -> 每列一個 bitmask（第 j 位 = 提到 channels[j]）；整個目錄算一次即可。"""
+    channels = channels or CHANNELS_8
+    text = pd.Series(slots, dtype=object).fillna("").astype(str).str.lower()
+    mask = np.zeros(len(text), dtype=np.uint32)
+    for j, ch in enumerate(channels):
+        pat = "|".join(re.escape(a) for a in CHANNEL_SLOT_ALIASES.get(ch, [ch.lower()]))
+        mask |= text.str.contains(pat, regex=True).to_numpy(dtype=bool).astype(np.uint32) << np.uint32(j)
+    return mask
+
+def affinity_matrix(mask, channels=None):
+    """bitmask (P,) -> persona × 渠道 的可觸及比例 (P × 渠道數)。"""
+    channels = channels or CHANNELS_8
+    bits = (np.asarray(mask, dtype=np.uint32)[:, None] >> np.arange(len(channels), dtype=np.uint32)) & 1
+    return np.where(bits == 1, REACH_AFFINITY_HIT, REACH_AFFINITY_BASE)
+
+def _union_size(sizes, universe, axis=0):
+    p = np.clip(np.asarray(sizes, dtype=np.float64) / universe, 0, 1)
+    with np.errstate(divide="ignore"):
+        return universe * -np.expm1(np.log1p(-p).sum(axis=axis))
+
+def dedup_audience(sizes, universe=REACH_UNIVERSE):
+    """多個 TA 的不重複人數：union = U · (1 − Π(1 − N_i / U))；取對數相加避免連乘下溢。"""
+    return float(_union_size(sizes, universe)) if len(sizes) else 0.0
+
+def _reach_hits(impressions, N, affinity):
+    # 曝光 (… × 渠道數) 依 TA 規模 × 可觸及比例分給各 persona -> persona 成員被各渠道觸及的機率 (… × P × 渠道數)
+    affinity = np.asarray(affinity, dtype=np.float64)
+    reachable = N[:, None] * affinity
+    # 沒有任何 persona 可觸及的渠道（可觸及比例全為 0）分不到曝光，避免 0 / 0
+    total = reachable.sum(axis=0)
+    share = np.divide(reachable, total, out=np.zeros_like(reachable), where=total > 0)
+    imp = impressions[..., None, :] * share
+    return affinity * -np.expm1(-imp / np.maximum(reachable, 1e-9))
+
+def batch_reach(weights, budgets, sizes, affinity, channels=None, unit_cpm=None, universe=REACH_UNIVERSE):
+    """N 組配比 (N × 渠道數) 的去重觸及與曝光 (N,)，公式同 reach_frequency；供最佳化一次評估多組配比。"""
+    channels = channels or CHANNELS_8
+    W = np.asarray(weights, dtype=np.float64).reshape(-1, len(channels))
+    budgets = np.broadcast_to(np.asarray(budgets, dtype=np.float64), (W.shape[0],))
+    N = np.asarray(sizes, dtype=np.float64)
+    total = W.sum(axis=1)
+    valid = (total > 0) & (budgets > 0)
+    share = np.divide(W, total[:, None], out=np.zeros_like(W), where=valid[:, None])
+    impressions = budgets[:, None] * share / rate_vector(UNIT_CPM if unit_cpm is None else unit_cpm, 200, channels) * 1000
+    if not len(N) or N.sum() <= 0:
+        return {"觸及": np.zeros(len(W), dtype=np.int64), "曝光": impressions.sum(axis=1).astype(np.int64)}
+    hit = _reach_hits(impressions, N, affinity)
+    with np.errstate(divide="ignore"):
+        reached = N * -np.expm1(np.log1p(-np.minimum(hit, 1.0)).sum(axis=2))
+    return {"觸及": np.rint(_union_size(reached, universe, axis=1)).astype(np.int64),
+            "曝光": impressions.sum(axis=1).astype(np.int64)}
+
+def reach_frequency(budget, mix, sizes, affinity, channels=None, unit_cpm=None, universe=REACH_UNIVERSE):
+    """預估一個檔期的去重觸及人數與平均頻次。
+
+    各渠道曝光 = 預算 × 配比 / CPM，依 TA 規模 × 可觸及比例分配給各 persona；
+    persona 內單一渠道以 Poisson 估計觸及率，跨渠道以 1 − Π(1 − 觸及率) 合併，
+    跨 TA 則把「persona 內被觸及的人數」當成母體中獨立分佈的集合取聯集（同 dedup_audience）。
+    sizes 為 (P,)，affinity 為 (P × 渠道數)。
+    """
+    channels = channels or CHANNELS_8
+    w = mix_matrix([mix or {}], channels)[0]
+    N = np.asarray(sizes, dtype=np.float64)
+    union = dedup_audience(N, universe) if len(N) else 0.0
+    empty = {"觸及": 0, "頻次": 0.0, "觸及率": 0.0, "TA人數": round(union), "曝光": 0, "渠道觸及": {}}
+    if w.sum() <= 0 or budget <= 0 or N.sum() <= 0:
+        return empty
+    impressions = budget * (w / w.sum()) / rate_vector(UNIT_CPM if unit_cpm is None else unit_cpm, 200, channels) * 1000
+    hit = _reach_hits(impressions, N, affinity)
+    with np.errstate(divide="ignore"):
+        reached = N * -np.expm1(np.log1p(-np.minimum(hit, 1.0)).sum(axis=1))   # 各 persona 內跨渠道被觸及的人數
+    reach = float(_union_size(reached, universe))
+    return {
+        "觸及": round(reach),
+        "頻次": round(float(impressions.sum() / reach), 2) if reach > 0 else 0.0,
+        "觸及率": reach / union if union > 0 else 0.0,
+        "TA人數": round(union),
+        "曝光": int(impressions.sum()),
+        "渠道觸及": dict(zip(channels, np.rint(_union_size(N[:, None] * hit, universe)).astype(np.int64).tolist())),
+    }
+
+# ---------- Pricing memo（跨 session 共用的 LRU 報價快取） ----------
+
+PRICING_MEMO_SIZE = 4096
+_PRICING_MEMO = OrderedDict()
+_PRICING_MEMO_LOCK = threading.Lock()
+_PRICING_MEMO_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+
+def pricing_memo_key(budget, mix, start, days, industry, version):
+    """正規化的快取鍵：配比依渠道排序、去掉 0%，數值統一型別，同一狀態不論來源都得到同一鍵。"""
+    mix_key = tuple(sorted((str(ch), float(v)) for ch, v in (mix or {}).items() if v))
+    return (float(budget), mix_key, str(start), int(days), industry or "", version)
+
+def pricing_memo_get(key, compute):
+    """命中時移到最新並回傳；未命中則在鎖外計算後寫入，超過 PRICING_MEMO_SIZE 時淘汰最久未用的項目。"""
+    with _PRICING_MEMO_LOCK:
+        if key in _PRICING_MEMO:
+            _PRICING_MEMO.move_to_end(key)
+            _PRICING_MEMO_STATS["hits"] += 1
+            return _PRICING_MEMO[key]
+        _PRICING_MEMO_STATS["misses"] += 1
+    value = compute()
+    with _PRICING_MEMO_LOCK:
+        _PRICING_MEMO[key] = value
+        _PRICING_MEMO.move_to_end(key)
+        while len(_PRICING_MEMO) > PRICING_MEMO_SIZE:
+            _PRICING_MEMO.popitem(last=False)
+            _PRICING_MEMO_STATS["evictions"] += 1
+    return value
+
+def pricing_memo_stats():
+    with _PRICING_MEMO_LOCK:
+        stats = dict(_PRICING_MEMO_STATS, size=len(_PRICING_MEMO), capacity=PRICING_MEMO_SIZE)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+def pricing_memo_clear():
+    with _PRICING_MEMO_LOCK:
+        _PRICING_MEMO.clear()
+        _PRICING_MEMO_STATS.update(hits=0, misses=0, evictions=0)
+
+def proposal_summary(budget, mix, start, days, industry=None, card=None, curves=None):
+    """提案摘要（報價、明細表、缺費率渠道、KPI、檔期費率），經 pricing memo 快取；回傳值為共用物件，請勿修改。
+
+    檔期內查不到日費率、CTR 或 CPA 的渠道列在 missing，不計入報價也不計入 KPI（不套用內建預設值）；
+    rates 只含其餘渠道，可直接傳給 Monte Carlo 與最佳化。
+    """
+    card = card or active_rate_card()
+    curves = curves or active_response_curves()
+    # 與 pricing_memo_key 相同的正規化（去掉 0%、固定渠道順序），快取結果才不會因呼叫端的配比寫法而不同
+    order = {ch: i for i, ch in enumerate(CHANNELS_8)}
+    mix = {ch: v for ch, v in sorted((mix or {}).items(), key=lambda kv: (order.get(kv[0], len(order)), str(kv[0]))) if v}
+    def compute():
+        _, breakdown, missing = quote_flight(start, days, mix, industry, card)
+        rates = flight_rate_tables(card, start, days, industry, list(mix))
+        missing = [ch for ch, pct in mix.items()
+                   if pct > 0 and (ch in missing or ch not in rates["ctr"] or ch not in rates["cpa"])]
+        breakdown = {ch: v for ch, v in breakdown.items() if ch not in missing}
+        rates = {f: {ch: v for ch, v in tbl.items() if ch not in missing} for f, tbl in rates.items()}
+        quote = int(sum(breakdown.values()))
+        return {
+            "報價": quote,
+            "明細": breakdown,
+            "明細表": pd.DataFrame({"渠道": list(breakdown.keys()), "金額(TWD)": list(breakdown.values())}),
+            "missing": missing,
+            "KPI": estimate_by_mix(budget, mix, rates["ctr"], rates["cpa"], curves, industry, days),
+            "rates": rates,
+            "version": card["version"],
+            "curves": curves["version"],
+        }
+    version = (card["version"], curves["version"])
+    return pricing_memo_get(pricing_memo_key(budget, mix, start, days, industry, version), compute)
+
+# ---------- GOAL-based channel templates (for M3) ----------
+
+INDUSTRIES = ["保健","運動/健身","寵物","家電","FMCG","美妝","其他"]
+GOALS = ["曝光","名單","購買"]
+
+CHANNELS_8 = ["FB","Google","Line","SMS","EDM","APP廣告","APP任務","APP Push"]
+
+GOAL_TEMPLATES = {
+    "曝光": {"FB":25,"Google":25,"APP廣告":20,"APP Push":10,"Line":10,"EDM":5,"SMS":3,"APP任務":2},
+    "名單": {"Google":30,"FB":25,"EDM":15,"Line":10,"SMS":10,"APP任務":5,"APP Push":3,"APP廣告":2},
+    "購買": {"Google":35,"FB":20,"EDM":15,"Line":10,"APP Push":8,"SMS":5,"APP廣告":5,"APP任務":2},
+}
+
+# ---------- Normalize (legacy -> canonical channels) ----------
+
+LEGACY_CH_MAP = {
+    "FB_動態": "FB",
+    "IG_限時": "FB",           # IG 歸入 FB 類型
+    "Google_搜尋": "Google",
+    "YouTube_展示": "Google",   # YouTube 歸入 Google 類型
+}
@@ -0,0 +1,327 @@
+# Shopper 分析（提案 Tab 1-3）的名單讀取：CSV / XLSX 都逐 chunk 讀檔、累加統計，只保留彙總結果與前幾列樣本。
+# 不相依 Streamlit；記憶體上限約為一個 chunk，與檔案大小無關。
+import io
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+SHOPPER_CHUNK_ROWS = 50_000
+SHOPPER_HEAD_ROWS = 5
+SHOPPER_DISTINCT_CAP = 1000   # 每欄最多追蹤的相異值個數，超過只記「> cap」
+SHOPPER_ID_UNIQUE_RATIO = 0.9   # 整數欄相異值 / 非空筆數 ≥ 此比例視為編號、電話類欄位，不記最小／最大值
+SHOPPER_REGION_COLUMNS = ["region","地區"]
+
+# ---------- 逐 chunk 彙總 ----------
+
+def new_profile():
+    return {
+        "rows": 0,
+        "columns": [],
+        "head": None,
+        "dtypes": {},
+        "nulls": {},
+        "distinct": {},
+        "numeric": {},
+        "region_col": None,
+        "region_counts": pd.Series(dtype=np.int64),
+    }
+
+def update_profile(profile, chunk):
+    """把一個 chunk 的統計併入 profile（就地更新）；chunk 用完即可丟棄。"""
+    if profile["head"] is None:
+        # 輪廓表的「型別」為讀檔時解析出的型別，取自留下來的 head；chunk 統計完就丟，不另轉型別
+        profile["head"] = chunk.head(SHOPPER_HEAD_ROWS).copy()
+        profile["dtypes"] = {col: str(dt) for col, dt in profile["head"].dtypes.items()}
+        profile["columns"] = chunk.columns.tolist()
+        profile["region_col"] = next((c for c in SHOPPER_REGION_COLUMNS if c in chunk.columns), None)
+    profile["rows"] += len(chunk)
+    nulls = chunk.isna().sum()
+    for col in chunk.columns:
+        profile["nulls"][col] = profile["nulls"].get(col, 0) + int(nulls[col])
+        s = chunk[col]
+        seen = profile["distinct"].get(col, set())
+        if seen is not None:
+            seen.update(s.dropna().unique().tolist())
+            profile["distinct"][col] = seen if len(seen) <= SHOPPER_DISTINCT_CAP else None
+        if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+            v = s.dropna()
+            if len(v):
+                agg = profile["numeric"].setdefault(col, {"count": 0, "sum": 0.0, "min": np.inf, "max": -np.inf,
+                                                          "unique": 0, "integral": True})
+                agg["count"] += len(v)
+                agg["sum"] += float(v.sum())
+                # 相異值超過 cap 後改以各 chunk 內相異值個數相加估算
+                agg["unique"] += int(v.nunique())
+                agg["integral"] = agg["integral"] and bool((v % 1 == 0).all())
+                agg["min"] = min(agg["min"], float(v.min()))
+                agg["max"] = max(agg["max"], float(v.max()))
+    rc = profile["region_col"]
+    if rc is not None and rc in chunk.columns:
+        vc = chunk[rc].value_counts()
+        vc = vc[vc > 0]
+        profile["region_counts"] = profile["region_counts"].add(vc, fill_value=0)
+    return profile
+
+def finish_profile(profile):
+    """彙總結果：rows、head、region_col、region_counts（多→少）、top_region、每欄的輪廓表 columns。"""
+    counts = profile["region_counts"].astype(np.int64).sort_values(ascending=False, kind="stable")
+    rows = profile["rows"]
+    table = []
+    for col in profile["columns"]:
+        seen = profile["distinct"].get(col)
+        num = profile["numeric"].get(col)
+        nulls = profile["nulls"].get(col, 0)
+        # 編號、電話這類幾乎每列不同的整數欄，最小／最大值就是某位會員的資料，不列入（彙總會進共用快取）
+        unique = len(seen) if seen is not None else num["unique"] if num else 0
+        ranged = num is not None and not (num["integral"] and unique >= SHOPPER_ID_UNIQUE_RATIO * num["count"])
+        table.append({
+            "欄位": col,
+            "型別": profile["dtypes"].get(col, ""),
+            "空值": nulls,
+            "空值比例": round(nulls / rows, 4) if rows else 0.0,
+            "相異值": str(len(seen)) if seen is not None else f"> {SHOPPER_DISTINCT_CAP:,}",
+            "最小": num["min"] if ranged else None,
+            "平均": round(num["sum"] / num["count"], 4) if num else None,
+            "最大": num["max"] if ranged else None,
+        })
+    return {
+        "rows": rows,
+        "head": profile["head"] if profile["head"] is not None else pd.DataFrame(),
+        "region_col": profile["region_col"],
+        "region_counts": counts,
+        "top_region": counts.index[0] if len(counts) else None,
+        "columns": pd.DataFrame(table, columns=["欄位","型別","空值","空值比例","相異值","最小","平均","最大"]),
+    }
+
+def iter_csv_chunks(fileobj, chunksize=SHOPPER_CHUNK_ROWS, progress=None):
+    """逐 chunk 讀 CSV；progress(已讀比例 0~1) 在每個 chunk 處理完後呼叫，依檔案讀取位置估算。"""
+    start = fileobj.tell()
+    size = fileobj.seek(0, io.SEEK_END) - start
+    fileobj.seek(start)
+    # utf-8-sig：Excel 另存的 CSV 常帶 BOM，否則第一欄名稱會多一個隱形字元
+    for chunk in pd.read_csv(fileobj, chunksize=chunksize, encoding="utf-8-sig"):
+        yield chunk
+        if progress is not None:
+            progress(min((fileobj.tell() - start) / size, 1.0) if size > 0 else None)
+
+def _xlsx_header(values):
+    # 比照 read_excel：空白欄名補 "Unnamed: i"，重複欄名加 ".1"、".2"
+    names, seen = [], {}
+    for i, v in enumerate(values):
+        name = f"Unnamed: {i}" if v is None or str(v).strip() == "" else v
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def iter_xlsx_chunks(fileobj, chunksize=SHOPPER_CHUNK_ROWS, progress=None):
+    """以 openpyxl read-only 模式逐列讀第一張工作表，每 chunksize 列組成一個 DataFrame；不建立整本 workbook 物件。
+
+    progress(已讀比例 0~1) 在每個 chunk 處理完後呼叫，依已讀列數 / 工作表列數估算；檔案沒有範圍標記時傳 None。
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        # 沒有 dimension 標記的檔案 read-only 讀不到範圍，改為依實際內容判斷；欄數以表頭與標記兩者較寬者為準
+        if ws.max_column is None:
+            ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        width = max(len(header), ws.max_column or 0)
+        columns = _xlsx_header(tuple(header) + (None,) * (width - len(header)))
+        max_row = ws.max_row
+        read = 1
+        buf = []
+        for row in rows:
+            read += 1
+            # 同 read_csv 的 skip_blank_lines：整列空白不算一筆
+            if all(v is None for v in row):
+                continue
+            row = row[:width] if len(row) >= width else row + (None,) * (width - len(row))
+            buf.append(row)
+            if len(buf) >= chunksize:
+                yield pd.DataFrame.from_records(buf, columns=columns)
+                buf = []
+                if progress is not None:
+                    progress(min(read / max_row, 1.0) if max_row else None)
+        if buf:
+            yield pd.DataFrame.from_records(buf, columns=columns)
+            if progress is not None:
+                progress(1.0)
+    finally:
+        wb.close()
+
+def profile_chunks(chunks):
+    profile = new_profile()
+    for chunk in chunks:
+        update_profile(profile, chunk)
+    return finish_profile(profile)
+
+def profile_upload(fileobj, name, chunksize=SHOPPER_CHUNK_ROWS, progress=None):
+    """依副檔名讀取上傳名單並回傳彙總輪廓（見 finish_profile）。
+
+    progress(已讀比例 0~1，無法估算時為 None) 每處理完一個 chunk 呼叫一次；
+    CSV 依檔案讀取位置，XLSX 依已讀列數 / 工作表列數（壓縮檔的位元組位置和資料量不成比例）。
+    """
+    reader = iter_csv_chunks if name.lower().endswith(".csv") else iter_xlsx_chunks
+    return profile_chunks(reader(fileobj, chunksize, progress))
+
+def read_upload_head(fileobj, name, rows=SHOPPER_HEAD_ROWS):
+    """只讀前 rows 列樣本（快取命中時補上該次上傳的 head，不必重新分析）。"""
+    reader = iter_csv_chunks if name.lower().endswith(".csv") else iter_xlsx_chunks
+    chunks = reader(fileobj, rows)
+    try:
+        head = next(chunks, None)
+    finally:
+        chunks.close()
+    return head if head is not None else pd.DataFrame()
+
+# ---------- 解析結果快取 ----------
+# 以檔案內容的 sha256 為鍵、跨 session 共用：同一份名單重傳（或同事再傳一次）直接取用彙總結果。
+# 只存彙總統計，不存 head 等個別會員資料；依估計大小做 LRU 淘汰，總量不超過 SHOPPER_PROFILE_CACHE_BYTES。
+
+SHOPPER_PROFILE_CACHE_BYTES = 64 << 20
+_PROFILE_CACHE = OrderedDict()   # key -> (profile, nbytes)
+_PROFILE_CACHE_LOCK = threading.Lock()
+_PROFILE_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+def upload_key(data, name):
+    kind = "csv" if name.lower().endswith(".csv") else "xlsx"
+    return f"{kind}:{hashlib.sha256(data).hexdigest()}"
+
+def profile_nbytes(profile):
+    """彙總結果的估計記憶體用量（輪廓表、地區計數）。"""
+    n = int(profile["columns"].memory_usage(index=True, deep=True).sum())
+    return n + int(profile["region_counts"].memory_usage(index=True, deep=True)) + 1024
+
+def profile_cache_get(key):
+    with _PROFILE_CACHE_LOCK:
+        if key in _PROFILE_CACHE:
+            _PROFILE_CACHE.move_to_end(key)
+            _PROFILE_CACHE_STATS["hits"] += 1
+            return _PROFILE_CACHE[key][0]
+        _PROFILE_CACHE_STATS["misses"] += 1
+        return None
+
+def profile_cache_put(key, profile):
+    # head 是個別會員資料，只回給上傳的 session，不進共用快取
+    profile = {k: v for k, v in profile.items() if k != "head"}
+    nbytes = profile_nbytes(profile)
+    if nbytes > SHOPPER_PROFILE_CACHE_BYTES:
+        return
+    with _PROFILE_CACHE_LOCK:
+        if key in _PROFILE_CACHE:
+            _PROFILE_CACHE_STATS["bytes"] -= _PROFILE_CACHE.pop(key)[1]
+        _PROFILE_CACHE[key] = (profile, nbytes)
+        _PROFILE_CACHE_STATS["bytes"] += nbytes
+        while _PROFILE_CACHE_STATS["bytes"] > SHOPPER_PROFILE_CACHE_BYTES:
+            _PROFILE_CACHE_STATS["bytes"] -= _PROFILE_CACHE.popitem(last=False)[1][1]
+            _PROFILE_CACHE_STATS["evictions"] += 1
+
+def profile_cache_stats():
+    with _PROFILE_CACHE_LOCK:
+        stats = dict(_PROFILE_CACHE_STATS, size=len(_PROFILE_CACHE), capacity_bytes=SHOPPER_PROFILE_CACHE_BYTES)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+def profile_cache_clear(key=None):
+    """清除某份名單（key 見 upload_key）的快取與尚未取走的分析結果；key 為 None 時全部清除。"""
+    with _PROFILE_CACHE_LOCK:
+        if key is None:
+            _PROFILE_CACHE.clear()
+            _PROFILE_CACHE_STATS.update(hits=0, misses=0, evictions=0, bytes=0)
+        elif key in _PROFILE_CACHE:
+            _PROFILE_CACHE_STATS["bytes"] -= _PROFILE_CACHE.pop(key)[1]
+    with _jobs_lock:
+        for job_id in [k for k, v in _jobs.items() if v["state"] != "running" and (key is None or v["key"] == key)]:
+            del _jobs[job_id]
+
+# ---------- 背景分析工作 ----------
+# 解析在執行緒裡跑，頁面只拿 job id 輪詢進度；結束後由 collect_profile_job 取走結果並移除工作。
+# 沒人取走的已結束工作保留 SHOPPER_JOB_TTL 秒、最多 SHOPPER_JOB_KEEP 筆
+
+SHOPPER_JOB_WORKERS = 2
+SHOPPER_JOB_KEEP = 32
+SHOPPER_JOB_TTL = 600
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_job_pool = None
+
+def _job_executor():
+    global _job_pool
+    with _jobs_lock:
+        if _job_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _job_pool = ThreadPoolExecutor(max_workers=SHOPPER_JOB_WORKERS, thread_name_prefix="shopper-job")
+        return _job_pool
+
+def _update_job(job_id, **fields):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+def _run_profile_job(job_id, key, data, name, chunksize):
+    try:
+        cached = profile_cache_get(key)
+        if cached is None:
+            result = profile_upload(io.BytesIO(data), name, chunksize,
+                                    progress=lambda p: _update_job(job_id, progress=p))
+            profile_cache_put(key, result)
+        else:
+            # 快取只有彙總統計；樣本列從這次上傳的內容讀，只讀前幾列
+            result = dict(cached, head=read_upload_head(io.BytesIO(data), name))
+    except Exception as e:
+        _update_job(job_id, state="error", error=str(e), finished=time.monotonic())
+    else:
+        _update_job(job_id, state="done", progress=1.0, cached=cached is not None, result=result,
+                    finished=time.monotonic())
+
+def submit_profile_job(data, name, chunksize=SHOPPER_CHUNK_ROWS):
+    """把上傳檔內容（bytes）丟給背景執行緒分析，立即回傳 job id。
+
+    內容已在快取裡時只讀樣本列、沿用快取的彙總；相同內容正在分析中則回傳那個工作的 id，不重複解析。
+    """
+    key = upload_key(data, name)
+    now = time.monotonic()
+    with _jobs_lock:
+        running = next((k for k, v in _jobs.items() if v["key"] == key and v["state"] == "running"), None)
+        if running is not None:
+            return running
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {"state": "running", "name": name, "key": key, "cached": False, "progress": 0.0,
+                         "total_bytes": len(data), "result": None, "error": None, "finished": None}
+        # 丟掉逾時沒人取走的、以及超過上限時最舊的已結束工作；進行中的不動
+        done = [k for k, v in _jobs.items() if v["state"] != "running"]
+        expired = {k for k in done if now - _jobs[k]["finished"] > SHOPPER_JOB_TTL}
+        for old in expired.union(done[:max(len(_jobs) - SHOPPER_JOB_KEEP, 0)]):
+            del _jobs[old]
+    _job_executor().submit(_run_profile_job, job_id, key, data, name, chunksize)
+    return job_id
+
+def profile_job_status(job_id):
+    """回傳工作狀態的副本：state（running / done / error）、progress（0~1，無法估算時為 None）、total_bytes、
+    result、error、cached（命中快取）；查無此工作為 None。"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+def collect_profile_job(job_id):
+    """取走已結束工作的狀態（同 profile_job_status）並從工作表移除；仍在執行或查無此工作時回傳 None。"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None or job["state"] == "running":
+            return None
+        return _jobs.pop(job_id)
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# app.py 是 Streamlit 腳本；不經 streamlit run 匯入時以 bare mode 執行，只用到其中的純函式
+from app import _unique_pairs, build_persona_ngram_index, search_persona_ngrams, top_k_personas
+
+# ---------- persona 全文搜尋（n-gram 索引） ----------
+
+ALPHABET = list("美妝保養母嬰旅遊外食健身科技寵物咖啡") + ["a", "b", "C"]
+
+@pytest.fixture(scope="module")
+def personas():
+    rng = np.random.default_rng(7)
+    n = 400
+    words = lambda k: " ".join("".join(rng.choice(ALPHABET, rng.integers(1, 5))) for _ in range(k))
+    return pd.DataFrame({
+        "name": [f"P{i:03d}{words(1)}" for i in range(n)],
+        "size": rng.integers(1000, 90000, n),
+        "pain": [words(3) for _ in range(n)],
+        "keywords": [words(2) + " 會員" for _ in range(n)],   # 每個 persona 都有「會員」
+        "slots": [words(1) for _ in range(n)],
+        "attitudes": [words(2) for _ in range(n)],
+    })
+
+def _brute_force(frame, query):
+    text = (frame["name"]+" "+frame["pain"]+" "+frame["keywords"]+" "+frame["slots"]+" "+frame["attitudes"]).str.lower()
+    terms = query.lower().split()
+    return np.array([i for i, t in enumerate(text) if all(term in t for term in terms)], dtype=np.int64)
+
+@pytest.mark.parametrize("query", [
+    "美", "c", "AB", "美妝", "物咖", "P00", "美妝a", "美妝保",
+    "美 a", "妝 c 物", "美妝 c", "a 會員 寵", "p1 美 妝", "ab c", "會員 美妝", "無此字", "美妝 無此字", "  ", "",
+])
+def test_search_matches_brute_force(personas, query):
+    index = build_persona_ngram_index(personas)
+    got = search_persona_ngrams(index, query)
+    np.testing.assert_array_equal(got, _brute_force(personas, query))
+
+def test_query_matching_every_persona(personas):
+    index = build_persona_ngram_index(personas)
+    np.testing.assert_array_equal(search_persona_ngrams(index, "會員"), np.arange(len(personas)))
+    np.testing.assert_array_equal(search_persona_ngrams(index, "會員 p"), np.arange(len(personas)))
+
+def test_empty_catalog():
+    index = build_persona_ngram_index(pd.DataFrame(columns=["name", "size", "pain", "keywords", "slots", "attitudes"]))
+    assert len(search_persona_ngrams(index, "美妝")) == 0
+
+@pytest.mark.parametrize("n", [500, 2**22])
+def test_unique_pairs_packed_and_lexsort_paths(n):
+    # n = 2**22 時 key × n 超過 uint64，走 lexsort；兩條路徑都要與逐一去重的結果相同
+    rng = np.random.default_rng(n)
+    keys = np.concatenate([rng.integers(0, 50, 3000), (1 << 42) + rng.integers(0, 2**40, 3000)]).astype(np.uint64)
+    keys = np.concatenate([keys, keys[:1000]])
+    docs = rng.integers(0, 500, len(keys)).astype(np.uint64)
+    docs[-1000:] = docs[:1000]
+    assert ((int(keys.max()) + 1) * n > 2**64) == (n == 2**22)
+    got_keys, got_docs = _unique_pairs(keys, docs, n)
+    expected = sorted(set(zip(keys.tolist(), docs.tolist())))
+    assert list(zip(got_keys.tolist(), got_docs.tolist())) == expected
+    assert got_docs.dtype == np.int32
+
+# ---------- 推薦前 k 名 ----------
+
+def _full_sort(scores, sizes, names, k):
+    order = sorted(range(len(scores)), key=lambda i: (-scores[i], -sizes[i], names[i]))
+    return np.array(order[:k], dtype=np.int64)
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("k", [1, 5, 37])
+def test_top_k_matches_full_sort_with_ties(seed, k):
+    # 分數、規模都只有少數幾種值，大量同分同規模，名稱才決定順序
+    rng = np.random.default_rng(seed)
+    n = 300
+    scores = rng.integers(0, 4, n).astype(np.float64) / 2
+    sizes = rng.choice([1000, 5000, 20000], n)
+    names = np.array([f"P{v:04d}" for v in rng.permutation(n)], dtype=object)
+    got = top_k_personas(scores, sizes, names, k)
+    np.testing.assert_array_equal(got, _full_sort(scores, sizes, names, k))
+
+@pytest.mark.parametrize("k", [8, 9, 50])
+def test_top_k_when_k_covers_every_persona(k):
+    scores = np.array([1.0, 2.0, 2.0, 0.5, 2.0, 1.0, 1.0, 3.0])
+    sizes = np.array([10, 30, 30, 10, 20, 40, 40, 5])
+    names = np.array(list("hgfedcba"), dtype=object)
+    got = top_k_personas(scores, sizes, names, k)
+    assert got.tolist() == [7, 2, 1, 4, 6, 5, 0, 3]
+    np.testing.assert_array_equal(got, _full_sort(scores, sizes, names, k))
+
+def test_top_k_empty():
+    assert len(top_k_personas(np.zeros(0), np.zeros(0), np.zeros(0, dtype=object), 5)) == 0
+    assert len(top_k_personas(np.ones(3), np.ones(3), np.array(list("abc"), dtype=object), 0)) == 0
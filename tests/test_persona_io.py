@@ -0,0 +1,119 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import persona_io
+from persona_io import merge_persona_parts, read_persona_workbook, resolve_persona_sources, sidecar_path
+
+# ---------- Feather sidecar ----------
+
+def _write_xlsx(path, rows):
+    pd.DataFrame(rows, columns=["Persona", "規模"]).to_excel(path, index=False)
+
+def _sidecar_stamp(path):
+    return persona_io.feather.read_table(sidecar_path(path)).schema.metadata[b"source_stamp"]
+
+@pytest.fixture
+def workbook(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "personas.xlsx")
+    _write_xlsx(path, [["小資族", 1000], ["新手爸媽", 2000]])
+    reads = []
+    read_excel = pd.read_excel
+    monkeypatch.setattr(persona_io.pd, "read_excel", lambda *a, **k: reads.append(a[0]) or read_excel(*a, **k))
+    first = read_persona_workbook(path)
+    assert reads == [path] and os.path.exists(sidecar_path(path))
+    return path, first, reads
+
+def test_matching_stamp_reads_only_the_sidecar(workbook, monkeypatch):
+    path, first, reads = workbook
+    # stamp 相同時既不讀 xlsx，也不算 checksum
+    monkeypatch.setattr(persona_io, "file_sha256", lambda p: pytest.fail("不應讀取 xlsx 計算 checksum"))
+    again = read_persona_workbook(path)
+    assert reads == [path]
+    pd.testing.assert_frame_equal(again, first)
+
+def test_touched_workbook_with_same_content_refreshes_the_stamp(workbook):
+    path, first, reads = workbook
+    stt = os.stat(path)
+    os.utime(path, ns=(stt.st_atime_ns, stt.st_mtime_ns + 5_000_000_000))
+    assert _sidecar_stamp(path) != persona_io._source_stamp(os.stat(path))
+    again = read_persona_workbook(path)
+    assert reads == [path]
+    pd.testing.assert_frame_equal(again, first)
+    assert _sidecar_stamp(path) == persona_io._source_stamp(os.stat(path))
+
+def test_changed_workbook_is_read_again(workbook):
+    path, first, reads = workbook
+    stt = os.stat(path)
+    _write_xlsx(path, [["小資族", 1500], ["銀髮族", 800], ["學生", 300]])
+    os.utime(path, ns=(stt.st_atime_ns, stt.st_mtime_ns + 5_000_000_000))
+    again = read_persona_workbook(path)
+    assert reads == [path, path]
+    assert again["Persona"].tolist() == ["小資族", "銀髮族", "學生"]
+    # 新的 sidecar 對應新內容，下次直接採用
+    assert _sidecar_stamp(path) == persona_io._source_stamp(os.stat(path))
+    pd.testing.assert_frame_equal(read_persona_workbook(path), again)
+    assert len(reads) == 2
+
+# ---------- 目錄來源與合併 ----------
+
+@pytest.fixture
+def catalog_dir(tmp_path):
+    folder = tmp_path / "personas"
+    folder.mkdir()
+    for name in ["b.xlsx", "a.xlsx", "~$a.xlsx", "notes.csv"]:
+        (folder / name).write_bytes(b"")
+    default = tmp_path / "default.xlsx"
+    default.write_bytes(b"")
+    return tmp_path, str(folder), str(default)
+
+def test_manifest_takes_priority(catalog_dir):
+    root, folder, default = catalog_dir
+    manifest = root / "persona_manifest.json"
+    manifest.write_text(json.dumps({"workbooks": [{"path": "q3.xlsx", "sheets": ["2025Q3", "VIP"]}, "extra.xlsx"],
+                                    "directory": "personas"}), encoding="utf-8")
+    assert resolve_persona_sources(str(manifest), folder, default) == [
+        (str(root / "q3.xlsx"), ("2025Q3", "VIP")),
+        (str(root / "extra.xlsx"), None),
+        (os.path.join(folder, "a.xlsx"), None),
+        (os.path.join(folder, "b.xlsx"), None),
+    ]
+    # 也接受直接列出 workbook 的 JSON 陣列
+    manifest.write_text(json.dumps(["q3.xlsx"]), encoding="utf-8")
+    assert resolve_persona_sources(str(manifest), folder, default) == [(str(root / "q3.xlsx"), None)]
+
+def test_directory_then_default_workbook(catalog_dir):
+    root, folder, default = catalog_dir
+    missing = str(root / "no_manifest.json")
+    # 目錄：只取 xlsx、略過 Excel 的暫存檔，依檔名排序
+    assert resolve_persona_sources(missing, folder, default) == [
+        (os.path.join(folder, "a.xlsx"), None), (os.path.join(folder, "b.xlsx"), None)]
+    assert resolve_persona_sources(missing, str(root / "no_dir"), default) == [(default, (0,))]
+    assert resolve_persona_sources(missing, "", str(root / "no_default.xlsx")) == []
+
+@pytest.mark.parametrize("body", ['{"workbooks": [{"path": "q3.xlsx"', '{"workbooks": [{"sheets": ["x"]}]}',
+                                  '{"workbooks": [3]}', '"personas"'])
+def test_malformed_manifest_warns_and_falls_back(catalog_dir, body):
+    root, folder, default = catalog_dir
+    manifest = root / "persona_manifest.json"
+    manifest.write_text(body, encoding="utf-8")
+    with pytest.warns(UserWarning, match="manifest"):
+        sources = resolve_persona_sources(str(manifest), folder, default)
+    assert sources == [(os.path.join(folder, "a.xlsx"), None), (os.path.join(folder, "b.xlsx"), None)]
+    with pytest.warns(UserWarning, match="manifest"):
+        assert resolve_persona_sources(str(manifest), "", default) == [(default, (0,))]
+
+def test_merge_keeps_the_later_source_for_duplicate_names():
+    q2 = pd.DataFrame({"Persona": ["小資族", "新手爸媽"], "規模": [1000, 2000], "_source": "q2.xlsx"})
+    # 名稱欄可為別名（例如「人設」），合併時統一為 Persona
+    q3 = pd.DataFrame({"人設": ["新手爸媽", "銀髮族"], "規模": [2500, 800], "_source": "q3.xlsx"})
+    q4 = pd.DataFrame({"Persona": ["小資族"], "規模": [1200], "_source": "q4.xlsx"})
+    merged = merge_persona_parts([q2, q3, q4])
+    assert merged.set_index("Persona")["規模"].to_dict() == {"新手爸媽": 2500, "銀髮族": 800, "小資族": 1200}
+    assert merged.set_index("Persona")["_source"].to_dict() == {"新手爸媽": "q3.xlsx", "銀髮族": "q3.xlsx",
+                                                                "小資族": "q4.xlsx"}
+    assert merged["Persona"].is_unique and "人設" not in merged.columns
+    assert merge_persona_parts([]) is None
@@ -0,0 +1,54 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from price_briefs import parse_mix, price_briefs
+from pricing import RESPONSE_CURVE_COLUMNS, compile_rate_card, compile_response_curves, proposal_summary
+
+@pytest.fixture
+def card():
+    cols = ["version","effective_from","effective_to","channel","industry","day_rate","ctr","cpa"]
+    return compile_rate_card(pd.DataFrame([
+        ["v1", "2025-01-01", "", "FB", "", 28000, 1.2, 140],
+        ["v1", "2025-01-01", "", "Google", "", 32000, 2.2, 110],
+        ["v1", "2025-01-01", "", "Line", "", 22000, np.nan, 160],
+    ], columns=cols), horizon=60)
+
+@pytest.fixture
+def curves():
+    return compile_response_curves(pd.DataFrame(columns=RESPONSE_CURVE_COLUMNS))
+
+def test_parse_mix_formats():
+    assert parse_mix("FB:30;Google:70") == {"FB": 30.0, "Google": 70.0}
+    assert parse_mix("FB=30,Google=70") == {"FB": 30.0, "Google": 70.0}
+    assert parse_mix('{"FB": 30, "Google": 70}') == {"FB": 30.0, "Google": 70.0}
+    assert parse_mix("  ") is None
+    with pytest.raises(ValueError):
+        parse_mix("FB")
+
+def test_briefs_match_proposal_summary(card, curves):
+    mixes = ["FB:50;Google:50", "FB:40;Line:30;Google:30", "FB:50;TikTok:50", "FB:100"]
+    starts = ["2025-02-01", "2025-02-01", "2025-02-01", "2024-06-01"]
+    df = pd.DataFrame({"brand": list("abcd"), "industry": "", "goal": "購買", "budget": "500000",
+                       "start": starts, "end": [str(pd.Timestamp(s) + pd.Timedelta(days=29))[:10] for s in starts],
+                       "mix": mixes})
+    res = price_briefs(df, card, curves)
+    for i, (mix, start) in enumerate(zip(mixes, starts)):
+        summary = proposal_summary(500000, parse_mix(mix), dt.date.fromisoformat(start), 30, card=card, curves=curves)
+        row = res.iloc[i]
+        assert row["報價"] == summary["報價"]
+        assert row["missing"] == "、".join(summary["missing"])
+        assert row["轉換"] == summary["KPI"]["轉換"]
+        assert row["CTR"] == pytest.approx(summary["KPI"]["CTR"], abs=0.011)
+        assert row["CPA"] == pytest.approx(summary["KPI"]["CPA"], abs=0.011)
+    # 檔期不在費率表內：沒有報價也沒有成效
+    assert res.loc[3, ["報價", "轉換", "CTR", "CPA"]].tolist() == [0, 0, 0, 0]
+
+def test_bad_rows_are_flagged(card, curves):
+    df = pd.DataFrame({"brand": ["a", "b"], "industry": "", "goal": "購買", "budget": ["x", "100000"],
+                       "start": ["2025-02-01", "bad"], "end": ["2025-02-10", "2025-02-10"], "mix": ["FB:100", "FB:100"]})
+    res = price_briefs(df, card, curves)
+    assert res["error"].tolist() == ["預算格式錯誤", "日期格式錯誤"]
+    assert (res["報價"] == 0).all()
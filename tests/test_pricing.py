@@ -0,0 +1,353 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pricing
+from pricing import (
+    CHANNELS_8, REACH_AFFINITY_BASE, REACH_UNIVERSE, RESPONSE_CURVE_COLUMNS, batch_quote, batch_reach,
+    compile_rate_card, compile_response_curves, dedup_audience, estimate_by_mix, flight_rate_tables, flight_rates,
+    load_response_curve_table, mix_matrix, optimize_mix, pricing_memo_clear, pricing_memo_get, pricing_memo_stats,
+    proposal_summary, quote_flight, reach_frequency, saturation, saturation_multiplier, sensitivity_grid,
+    simulate_mix_kpis,
+)
+
+# ---------- 費率表編譯 ----------
+
+def _table(rows):
+    cols = ["version","effective_from","effective_to","channel","industry","day_rate","ctr","cpa"]
+    return pd.DataFrame(rows, columns=cols)
+
+@pytest.fixture
+def card():
+    # v2 從 2/1 起調漲 FB 日費率（CTR/CPA 留空沿用 v1）；美妝另有 Google 費率；Line 只在 1/10 ~ 1/19 有費率
+    return compile_rate_card(_table([
+        ["v1", "2025-01-01", "", "FB", "", 1000, 1.0, 100],
+        ["v1", "2025-01-01", "", "Google", "", 2000, 2.0, 50],
+        ["v1", "2025-01-10", "2025-01-19", "Line", "", 500, 0.5, 200],
+        ["v1", "2025-01-01", "", "Google", "美妝", 3000, np.nan, np.nan],
+        ["v2", "2025-02-01", "", "FB", "", 1500, np.nan, np.nan],
+    ]), horizon=30)
+
+@pytest.fixture
+def linear():
+    return compile_response_curves(pd.DataFrame(columns=RESPONSE_CURVE_COLUMNS))
+
+def test_rate_card_version_and_layout(card):
+    assert card["version"].startswith("v2@")
+    assert card["start"] == np.datetime64("2025-01-01")
+    assert card["industries"] == ["", "美妝"]
+    assert card["channels"][:len(CHANNELS_8)] == CHANNELS_8
+
+def test_flight_spanning_a_rate_change_is_priced_per_day(card):
+    rates = flight_rates(card, "2025-01-30", 5, channels=["FB"])
+    assert rates["day_rate"][0, 0] == 2 * 1000 + 3 * 1500
+    assert rates["ctr"][0, 0] == 1.0 and rates["cpa"][0, 0] == 100
+
+def test_industry_layer_overrides_only_its_fields(card):
+    generic = flight_rate_tables(card, "2025-03-01", 10, None, ["Google"])
+    beauty = flight_rate_tables(card, "2025-03-01", 10, "美妝", ["Google"])
+    assert generic["day_rate"]["Google"] == 2000
+    assert beauty["day_rate"]["Google"] == 3000
+    assert beauty["ctr"]["Google"] == 2.0
+
+def test_flight_after_the_table_keeps_the_last_day(card):
+    late = flight_rates(card, "2026-06-01", 3, channels=["FB", "Google"])
+    np.testing.assert_array_equal(late["day_rate"][0], [4500, 6000])
+
+def test_missing_days_make_the_channel_nan(card):
+    inside = flight_rates(card, "2025-01-10", 10, channels=["Line"])
+    partial = flight_rates(card, "2025-01-15", 10, channels=["Line"])
+    before = flight_rates(card, "2024-12-01", 5, channels=["FB", "Google"])
+    assert inside["day_rate"][0, 0] == 5000
+    assert np.isnan(partial["day_rate"][0, 0]) and np.isnan(partial["ctr"][0, 0])
+    assert np.isnan(before["day_rate"]).all()
+    assert np.isnan(flight_rates(card, "2025-03-01", 5, channels=["TikTok"])["day_rate"]).all()
+
+def test_quote_flight_reports_missing_channels(card):
+    quote, breakdown, missing = quote_flight("2025-01-15", 10, {"FB": 50, "Line": 50}, card=card)
+    assert missing == ["Line"]
+    assert breakdown == {"FB": 5000} and quote == 5000
+
+def test_sensitivity_grid_matches_quote_flight(card, linear):
+    # 1/28 起：跨 2/1 的 FB 調價；Line 只有 1/10 ~ 1/19 的費率，整段檔期都查不到
+    mix = {"FB": 50, "Google": 30, "Line": 20}
+    for start in ["2025-01-28", "2025-01-12"]:
+        day_counts = np.array([1, 3, 8, 15])
+        rates = flight_rates(card, np.repeat(np.datetime64(start), len(day_counts)), day_counts, channels=list(mix))
+        ctr = {ch: v for ch, v in zip(mix, rates["ctr"][0]) if not np.isnan(v)}
+        cpa = {ch: v for ch, v in zip(mix, rates["cpa"][0]) if not np.isnan(v)}
+        grid = sensitivity_grid(mix, [100_000, 400_000, 2_000_000], day_counts, rates["day_rate"], ctr, cpa, curves=linear)
+        assert len(grid) == 12
+        for row in grid.itertuples():
+            quote, _, _ = quote_flight(start, row.天數, mix, card=card)
+            assert row.報價 == quote
+    # 1/12 起 8 天還在 Line 的費率區間內，15 天則超出，Line 不計入報價
+    assert quote_flight("2025-01-12", 8, mix, card=card)[2] == []
+    assert quote_flight("2025-01-12", 15, mix, card=card)[2] == ["Line"]
+
+# ---------- 查不到費率的渠道不計入 KPI ----------
+
+def test_flight_outside_the_card_has_no_kpis(card, linear):
+    summary = proposal_summary(500000, {"FB": 50, "Google": 50}, dt.date(2024, 12, 1), 5, card=card, curves=linear)
+    assert summary["報價"] == 0
+    assert summary["missing"] == ["FB", "Google"]
+    assert summary["KPI"] == {"CTR": 0, "CPA": 0, "轉換": 0, "ROAS": 0, "成本": 0}
+    assert summary["rates"] == {"day_rate": {}, "ctr": {}, "cpa": {}}
+
+def test_partially_priced_mix_counts_only_priced_budget(card, linear):
+    summary = proposal_summary(100000, {"FB": 50, "Line": 50}, dt.date(2025, 1, 15), 10, card=card, curves=linear)
+    assert summary["missing"] == ["Line"]
+    assert list(summary["明細"]) == ["FB"]
+    kpi = summary["KPI"]
+    assert kpi["成本"] == 50000
+    assert kpi["CTR"] == 1.0 and kpi["CPA"] == 100
+    assert kpi["轉換"] == 500
+
+def test_estimate_ignores_channels_without_rates():
+    full = estimate_by_mix(100000, {"FB": 100}, {"FB": 1.2}, {"FB": 140})
+    half = estimate_by_mix(100000, {"FB": 50, "Google": 50}, {"FB": 1.2}, {"FB": 140})
+    assert half["CTR"] == full["CTR"] and half["CPA"] == full["CPA"]
+    assert half["成本"] == 50000 and half["轉換"] == full["轉換"] // 2
+    assert estimate_by_mix(100000, {"FB": 100}, {}, {})["轉換"] == 0
+
+def test_simulation_ignores_channels_without_rates():
+    kw = dict(n=2000, seed=7)
+    full = simulate_mix_kpis(100000, {"FB": 100}, 10, unit_ctr={"FB": 1.2}, unit_cpa={"FB": 140}, **kw)
+    half = simulate_mix_kpis(100000, {"FB": 50, "Google": 50}, 10, unit_ctr={"FB": 1.2}, unit_cpa={"FB": 140}, **kw)
+    assert half["CTR"] == full["CTR"]
+    assert half["轉換"][1] == pytest.approx(full["轉換"][1] / 2, abs=1)
+    assert simulate_mix_kpis(100000, {"FB": 100}, 10, unit_ctr={}, unit_cpa={}, **kw) == {}
+
+def test_batch_quote_matches_estimate_by_mix():
+    rng = np.random.default_rng(0)
+    ctr = {ch: v for ch, v in zip(CHANNELS_8, [1.2, 2.2, 1.0, 0.8, 1.0, 1.1, 0.9, 1.3]) if ch != "SMS"}
+    cpa = {ch: v for ch, v in zip(CHANNELS_8, [140, 110, 160, 180, 170, 150, 190, 160]) if ch != "Line"}
+    W = rng.integers(0, 5, size=(300, len(CHANNELS_8))) * 5
+    W = W[W.sum(axis=1) > 0]
+    budgets = rng.integers(10_000, 1_000_000, size=len(W)).astype(float)
+    out = batch_quote(W, 30, budgets, CHANNELS_8, None, ctr, cpa)
+    for k, w in enumerate(W):
+        est = estimate_by_mix(budgets[k], dict(zip(CHANNELS_8, w.tolist())), ctr, cpa, days=30)
+        # np.round 與 round 在 .xx5 上可能差 0.01，其餘應完全一致
+        assert out["CTR"][k] == pytest.approx(est["CTR"], abs=0.011)
+        assert out["CPA"][k] == pytest.approx(est["CPA"], abs=0.011)
+        assert out["轉換"][k] == est["轉換"]
+        assert out["成本"][k] == pytest.approx(est["成本"])
+
+def test_batch_quote_excludes_nan_rate_totals():
+    W = mix_matrix([{"FB": 50, "Google": 50}], ["FB", "Google"])
+    totals = np.array([[10000.0, np.nan]])
+    out = batch_quote(W, 10, 100000, ["FB", "Google"], unit_ctr={"FB": 1.0, "Google": 2.0},
+                      unit_cpa={"FB": 100, "Google": 50}, rate_totals=totals)
+    assert out["報價"][0] == 5000
+    assert out["CPA"][0] == 100 and out["成本"][0] == 50000 and out["轉換"][0] == 500
+
+# ---------- 反應曲線 ----------
+
+SPEND = np.geomspace(1e-3, 1e12, 2000)
+
+@pytest.mark.parametrize("hill", [0.05, 0.5, 1.0, 2.0, 10.0])
+def test_hill_multiplier_is_bounded_and_monotone(hill):
+    m = saturation_multiplier("hill", SPEND, 1000, hill)
+    assert (m > 0).all() and (m <= 1).all()
+    assert (np.diff(m) <= 0).all()
+    conv = SPEND * m
+    assert (np.diff(conv) >= -1e-9 * conv[1:]).all()
+
+def test_hill_one_is_half_of_linear_at_half_sat():
+    assert saturation_multiplier("hill", 1000, 1000, 1.0) == pytest.approx(0.5)
+    assert saturation_multiplier("log", 1e-9, 1000) == pytest.approx(1.0)
+
+def test_log_multiplier_is_bounded():
+    m = saturation_multiplier("log", SPEND, 1000)
+    assert (m > 0).all() and (m <= 1).all() and (np.diff(m) <= 0).all()
+
+def test_loader_drops_out_of_range_hill(tmp_path):
+    path = tmp_path / "curves.csv"
+    path.write_text("channel,industry,curve,half_sat,hill\n"
+                    "FB,,hill,1000,0.5\nGoogle,,hill,1000,-1\nLine,,hill,1000,50\n"
+                    "SMS,,log,1000,\nEDM,,hill,1000,abc\nAPP廣告,,hill,0,1\n", encoding="utf-8")
+    table = load_response_curve_table(str(path))
+    assert table["channel"].tolist() == ["FB", "SMS"]
+    assert table["hill"].tolist() == [0.5, 1.0]
+
+def test_compiled_saturation_is_bounded(tmp_path):
+    path = tmp_path / "curves.csv"
+    path.write_text("channel,industry,curve,half_sat,hill\nFB,,hill,50000,0.3\nGoogle,,hill,50000,8\n"
+                    "SMS,,log,40000,\nFB,美妝,hill,10000,2\n", encoding="utf-8")
+    curves = compile_response_curves(load_response_curve_table(str(path)))
+    spend = np.geomspace(1, 1e10, 500)[:, None] * np.ones(len(CHANNELS_8))
+    for industry in (None, "美妝"):
+        m = saturation(curves, spend, industry)
+        assert (m > 0).all() and (m <= 1).all()
+        assert (np.diff(m, axis=0) <= 1e-12).all()
+    # 沒有曲線的渠道為線性
+    np.testing.assert_array_equal(saturation(curves, spend, None)[:, CHANNELS_8.index("EDM")], 1.0)
+
+# ---------- 配比最佳化 ----------
+
+def _check_plans(plans, budget, days, lo, hi, channels=CHANNELS_8):
+    for plan in plans:
+        mix = plan["mix"]
+        assert sum(mix.values()) == 100
+        assert all(lo.get(ch, 0) <= mix[ch] <= hi.get(ch, 100) for ch in channels)
+        assert plan["報價"] <= budget
+        assert plan["報價"] == batch_quote(mix_matrix([mix], channels), days, budget, channels)["報價"][0]
+
+@pytest.mark.parametrize("seed", range(8))
+def test_optimizer_respects_budget_and_bounds(seed):
+    rng = np.random.default_rng(seed)
+    budget = float(rng.integers(200_000, 3_000_000))
+    days = int(rng.integers(1, 45))
+    lo = {ch: int(v) for ch, v in zip(CHANNELS_8, rng.integers(0, 8, len(CHANNELS_8)))}
+    hi = {ch: int(v) for ch, v in zip(CHANNELS_8, rng.integers(30, 101, len(CHANNELS_8)))}
+    goal = ["曝光", "名單", "購買"][seed % 3]
+    plans = optimize_mix(budget, days, goal, lo, hi)
+    _check_plans(plans, budget, days, lo, hi)
+    key = "觸及" if goal == "曝光" else "轉換"
+    assert [p[key] for p in plans] == sorted((p[key] for p in plans), reverse=True)
+
+@pytest.mark.parametrize("goal", ["曝光", "購買"])
+def test_optimizer_is_close_to_brute_force(goal):
+    channels = ["FB", "Google", "SMS"]
+    budget, days = 800_000.0, 20
+    grid = np.array([(a, b, 100 - a - b) for a in range(101) for b in range(101 - a)], dtype=np.float64)
+    out = batch_quote(grid, days, budget, channels)
+    out.update(batch_reach(grid, budget, [REACH_UNIVERSE], np.full((1, 3), REACH_AFFINITY_BASE), channels))
+    key = "觸及" if goal == "曝光" else "轉換"
+    best = out[key][out["報價"] <= budget].max()
+    plans = optimize_mix(budget, days, goal, channels=channels)
+    _check_plans(plans, budget, days, {}, {}, channels)
+    assert plans[0][key] >= 0.98 * best
+
+def test_awareness_goal_spreads_budget_for_reach():
+    # CTR 最高的是 Google，但曝光目標看的是去重觸及：單押一個渠道會很快飽和
+    sizes = [300_000, 120_000]
+    affinity = np.array([[0.9, 0.3, 0.9, 0.3, 0.3, 0.9, 0.3, 0.3],
+                         [0.3, 0.9, 0.3, 0.9, 0.3, 0.3, 0.9, 0.3]])
+    for kwargs in ({}, {"sizes": sizes, "affinity": affinity}):
+        plans = optimize_mix(3_000_000, 30, "曝光", **kwargs)
+        assert plans
+        best = plans[0]
+        assert best["mix"]["Google"] < 100 and sum(v > 0 for v in best["mix"].values()) > 1
+        google_only = batch_reach(mix_matrix([{"Google": 100}]), 3_000_000, kwargs.get("sizes", [REACH_UNIVERSE]),
+                                  kwargs.get("affinity", np.full((1, 8), REACH_AFFINITY_BASE)))
+        assert best["觸及"] > google_only["觸及"][0]
+
+def test_batch_reach_matches_reach_frequency():
+    sizes = [300_000, 120_000, 50_000]
+    affinity = np.random.default_rng(1).uniform(0.1, 0.9, (3, len(CHANNELS_8)))
+    mixes = [{"FB": 50, "Google": 50}, {"Line": 20, "SMS": 30, "APP Push": 50}, dict.fromkeys(CHANNELS_8, 12.5)]
+    out = batch_reach(mix_matrix(mixes), 1_500_000, sizes, affinity)
+    for k, mix in enumerate(mixes):
+        rf = reach_frequency(1_500_000, mix, sizes, affinity)
+        assert out["觸及"][k] == pytest.approx(rf["觸及"], abs=1)
+        assert out["曝光"][k] == pytest.approx(rf["曝光"], abs=1)
+
+def test_optimizer_returns_nothing_when_infeasible():
+    assert optimize_mix(1000, 30, "購買") == []
+    assert optimize_mix(1_000_000, 10, "購買", lo={"FB": 60, "Google": 60}) == []
+    assert optimize_mix(1_000_000, 10, "購買", hi={ch: 10 for ch in CHANNELS_8}) == []
+
+def test_optimizer_never_funds_unpriced_channels():
+    day_rate = {ch: v for ch, v in zip(CHANNELS_8, [28000, 32000, 22000, 15000, 18000, 26000, 20000, 17000])}
+    del day_rate["Google"]
+    plans = optimize_mix(2_000_000, 20, "購買", day_rate=day_rate)
+    assert plans and all(p["mix"]["Google"] == 0 for p in plans)
+    assert optimize_mix(2_000_000, 20, "購買", lo={"Google": 5}, day_rate=day_rate) == []
+
+# ---------- 去重觸及與頻次 ----------
+
+REACH_SIZES = [300_000, 120_000, 50_000, 8_000]
+
+@pytest.fixture
+def reach_affinity():
+    return np.random.default_rng(5).uniform(0.1, 0.9, (len(REACH_SIZES), len(CHANNELS_8)))
+
+def test_dedup_audience_bounds():
+    assert dedup_audience([]) == 0.0
+    assert dedup_audience([250_000]) == pytest.approx(250_000)
+    union = dedup_audience(REACH_SIZES)
+    assert max(REACH_SIZES) <= union <= sum(REACH_SIZES)
+    assert dedup_audience([REACH_UNIVERSE, 1000]) == pytest.approx(REACH_UNIVERSE)
+
+@pytest.mark.parametrize("budget", [10_000, 500_000, 5_000_000, 500_000_000])
+def test_reach_is_bounded_and_consistent_with_frequency(reach_affinity, budget):
+    rf = reach_frequency(budget, {"FB": 40, "Google": 30, "Line": 20, "EDM": 10}, REACH_SIZES, reach_affinity)
+    assert 0 < rf["觸及"] <= min(REACH_UNIVERSE, sum(REACH_SIZES), rf["TA人數"])
+    assert rf["TA人數"] == round(dedup_audience(REACH_SIZES))
+    assert rf["觸及率"] == pytest.approx(rf["觸及"] / rf["TA人數"], rel=1e-4)
+    # 頻次 = 曝光 / 觸及（頻次四捨五入到小數 2 位）
+    assert rf["頻次"] * rf["觸及"] == pytest.approx(rf["曝光"], abs=0.005 * rf["觸及"] + rf["頻次"])
+    assert all(0 <= v <= rf["觸及"] for v in rf["渠道觸及"].values())
+
+def test_reach_grows_with_budget(reach_affinity):
+    mix = {"FB": 50, "APP Push": 50}
+    reach = [reach_frequency(b, mix, REACH_SIZES, reach_affinity)["觸及"] for b in [1e4, 1e5, 1e6, 1e7]]
+    assert reach == sorted(reach)
+
+def test_single_segment_reach_is_capped_by_its_size():
+    rf = reach_frequency(1e9, {"FB": 100}, [80_000], [[1.0] * len(CHANNELS_8)])
+    assert rf["TA人數"] == 80_000
+    assert rf["觸及"] == pytest.approx(80_000, rel=1e-3)
+
+def test_zero_budget_or_audience_reaches_nobody(reach_affinity):
+    for rf in (reach_frequency(0, {"FB": 100}, REACH_SIZES, reach_affinity),
+               reach_frequency(500_000, {}, REACH_SIZES, reach_affinity),
+               reach_frequency(500_000, {"FB": 100}, [], np.zeros((0, len(CHANNELS_8))))):
+        assert rf["觸及"] == 0 and rf["頻次"] == 0.0 and rf["曝光"] == 0
+
+def test_zero_affinity_channel_reaches_nobody(reach_affinity):
+    affinity = reach_affinity.copy()
+    affinity[:, CHANNELS_8.index("SMS")] = 0.0
+    only_sms = reach_frequency(500_000, {"SMS": 100}, REACH_SIZES, affinity)
+    assert only_sms["觸及"] == 0 and only_sms["頻次"] == 0.0 and only_sms["渠道觸及"]["SMS"] == 0
+    mixed = reach_frequency(500_000, {"SMS": 50, "FB": 50}, REACH_SIZES, affinity)
+    assert mixed["觸及"] == reach_frequency(250_000, {"FB": 100}, REACH_SIZES, affinity)["觸及"]
+    out = batch_reach(mix_matrix([{"SMS": 100}, {"SMS": 50, "FB": 50}]), 500_000, REACH_SIZES, affinity)
+    assert out["觸及"].tolist() == [0, mixed["觸及"]]
+    none = reach_frequency(500_000, {"FB": 100}, REACH_SIZES, np.zeros_like(affinity))
+    assert none["觸及"] == 0 and none["頻次"] == 0.0
+
+# ---------- Pricing memo ----------
+
+@pytest.fixture
+def memo(monkeypatch):
+    monkeypatch.setattr(pricing, "PRICING_MEMO_SIZE", 3)
+    pricing_memo_clear()
+    yield
+    pricing_memo_clear()
+
+def test_memo_evicts_least_recently_used(memo):
+    calls = []
+    get = lambda key: pricing_memo_get(key, lambda: calls.append(key) or {"key": key})
+    for key in "abc":
+        get(key)
+    assert get("a") == {"key": "a"}           # a 變成最近使用
+    get("d")                                  # 淘汰最久未用的 b
+    assert calls == list("abcd")
+    assert pricing_memo_stats() == {"hits": 1, "misses": 4, "evictions": 1, "size": 3, "capacity": 3,
+                                    "hit_rate": 0.2}
+    for key in "acd":
+        get(key)
+    assert calls == list("abcd")
+    get("b")                                  # b 已被淘汰，需重算並淘汰 a
+    assert calls == list("abcdb")
+    stats = pricing_memo_stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (4, 5, 2, 3)
+    get("a")
+    assert calls == list("abcdba")
+
+def test_proposal_summary_repeat_is_memoized(card, linear, memo):
+    start = dt.date(2025, 1, 5)
+    first = proposal_summary(500_000, {"FB": 60, "Google": 40}, start, 10, card=card, curves=linear)
+    # 同一提案換個寫法（順序不同、多了 0% 渠道）也命中同一筆
+    again = proposal_summary(500_000.0, {"Google": 40, "FB": 60, "Line": 0}, start, 10, card=card, curves=linear)
+    assert again is first
+    stats = pricing_memo_stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (1, 1, 0, 1)
+    other = proposal_summary(600_000, {"FB": 60, "Google": 40}, start, 10, card=card, curves=linear)
+    assert other is not first and other["KPI"] != first["KPI"]
+    assert pricing_memo_stats()["misses"] == 2
@@ -0,0 +1,209 @@
+import io
+import re
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import shopper_ingest
+from shopper_ingest import (
+    SHOPPER_DISTINCT_CAP, SHOPPER_ID_UNIQUE_RATIO, collect_profile_job, profile_cache_clear, profile_cache_get, profile_cache_stats,
+    profile_job_status, profile_upload, submit_profile_job, upload_key,
+)
+
+REGIONS = ["台北市", "新北市", "台中市", "高雄市", "桃園市", "台南市"]
+
+@pytest.fixture(scope="module")
+def members():
+    rng = np.random.default_rng(3)
+    n = 2500
+    region = rng.choice(REGIONS, n).astype(object)
+    region[rng.random(n) < 0.05] = None
+    spend = rng.integers(0, 20000, n).astype(np.float64)
+    spend[rng.random(n) < 0.1] = np.nan
+    # 手機號碼讀進來是數字（開頭的 0 被吃掉）；有空值所以是 float
+    phone = 900_000_000 + rng.choice(100_000_000, n, replace=False).astype(np.float64)
+    phone[rng.random(n) < 0.02] = np.nan
+    return pd.DataFrame({
+        "member_id": np.arange(n) + 10_000_000,
+        "region": region,
+        "tier": rng.choice(["一般", "金卡", "白金"], n),
+        "age": rng.integers(18, 80, n),
+        "spend": spend,
+        "joined": pd.to_datetime("2015-01-01") + pd.to_timedelta(rng.integers(0, 3000, n), unit="D"),
+        "email": [f"u{i}@example.com" for i in range(n)],
+        "phone": phone,
+    })
+
+def _check_against_pandas(profile, df):
+    assert profile["rows"] == len(df)
+    assert profile["region_col"] == "region"
+    expected = df["region"].value_counts()
+    got = profile["region_counts"]
+    assert dict(got) == dict(expected)
+    assert profile["top_region"] == expected.idxmax()
+    assert (got.diff().dropna() <= 0).all()
+    cols = profile["columns"].set_index("欄位")
+    assert cols.index.tolist() == df.columns.tolist()
+    for col in df.columns:
+        s = df[col]
+        assert cols.loc[col, "空值"] == s.isna().sum()
+        n_distinct = s.nunique()
+        assert cols.loc[col, "相異值"] == (str(n_distinct) if n_distinct <= SHOPPER_DISTINCT_CAP
+                                          else f"> {SHOPPER_DISTINCT_CAP:,}")
+        if pd.api.types.is_numeric_dtype(s):
+            v = s.dropna()
+            if (v % 1 == 0).all() and v.nunique() >= SHOPPER_ID_UNIQUE_RATIO * len(v):
+                # 編號、電話類欄位不記最小／最大值
+                assert pd.isna(cols.loc[col, "最小"]) and pd.isna(cols.loc[col, "最大"])
+            else:
+                assert cols.loc[col, "最小"] == s.min()
+                assert cols.loc[col, "最大"] == s.max()
+            assert cols.loc[col, "平均"] == pytest.approx(s.mean(), abs=1e-4)
+    assert len(profile["head"]) == 5
+    assert profile["head"]["member_id"].tolist() == df["member_id"].head(5).tolist()
+
+@pytest.mark.parametrize("chunksize", [100, 999, 100_000])
+def test_chunked_csv_matches_one_shot_read(members, chunksize):
+    data = members.to_csv(index=False).encode("utf-8-sig")
+    profile = profile_upload(io.BytesIO(data), "members.csv", chunksize)
+    _check_against_pandas(profile, pd.read_csv(io.BytesIO(data), encoding="utf-8-sig"))
+    assert profile["columns"].loc[0, "欄位"] == "member_id"   # BOM 不留在第一欄名稱
+
+def test_types_are_the_parsed_dtypes_of_the_head(members):
+    data = members.to_csv(index=False).encode("utf-8")
+    profile = profile_upload(io.BytesIO(data), "members.csv", 500)
+    types = profile["columns"].set_index("欄位")["型別"]
+    expected = pd.read_csv(io.BytesIO(data), nrows=500).dtypes.astype(str)
+    assert types.to_dict() == expected.to_dict()
+    assert profile["head"].dtypes.astype(str).to_dict() == expected.to_dict()
+
+def test_empty_csv_has_no_rows():
+    profile = profile_upload(io.BytesIO(b"region,age\n"), "empty.csv")
+    assert profile["rows"] == 0 and profile["top_region"] is None
+    assert profile["columns"]["欄位"].tolist() == ["region", "age"]
+
+# ---------- XLSX 串流讀取與進度 ----------
+
+def _xlsx_bytes(df):
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+def _strip_dimension(data):
+    # 部分匯出工具不寫 <dimension>，read-only 模式就讀不到工作表範圍
+    src, out = zipfile.ZipFile(io.BytesIO(data)), io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as z:
+        for item in src.infolist():
+            body = src.read(item)
+            if item.filename.startswith("xl/worksheets/"):
+                body = re.sub(rb"<dimension[^>]*/>", b"", body)
+            z.writestr(item, body)
+    return out.getvalue()
+
+@pytest.mark.parametrize("chunksize", [300, 100_000])
+def test_chunked_xlsx_matches_read_excel(members, chunksize):
+    data = _xlsx_bytes(members)
+    profile = profile_upload(io.BytesIO(data), "members.xlsx", chunksize)
+    _check_against_pandas(profile, pd.read_excel(io.BytesIO(data)))
+
+def test_xlsx_without_dimension_matches_read_excel(members):
+    data = _strip_dimension(_xlsx_bytes(members.head(700)))
+    progress = []
+    profile = profile_upload(io.BytesIO(data), "members.xlsx", 200, progress.append)
+    _check_against_pandas(profile, pd.read_excel(io.BytesIO(data)))
+    # 沒有範圍可估算：中途回報 None，讀完最後一批為 1
+    assert progress[:-1] == [None] * (len(progress) - 1) and progress[-1] == 1.0
+
+def test_xlsx_blank_rows_and_headers_follow_read_excel():
+    from openpyxl import Workbook
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["region", None, "region", "age"])
+    ws.append(["台北市", 1, "x", 30])
+    ws.append([None, None, None, None])
+    ws.append(["台中市", 2, "y", 40, "extra"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    profile = profile_upload(io.BytesIO(buf.getvalue()), "odd.xlsx")
+    # 整列空白的列比照 read_csv 不計入（read_excel 會保留成一列 NaN）
+    expected = pd.read_excel(io.BytesIO(buf.getvalue())).dropna(how="all")
+    assert profile["rows"] == len(expected) == 2
+    assert profile["columns"]["欄位"].tolist() == expected.columns.tolist()
+
+@pytest.mark.parametrize("name", ["members.csv", "members.xlsx"])
+def test_progress_is_monotone_and_finishes(members, name):
+    data = members.to_csv(index=False).encode() if name.endswith(".csv") else _xlsx_bytes(members)
+    progress = []
+    profile_upload(io.BytesIO(data), name, 400, progress.append)
+    assert len(progress) == -(-len(members) // 400)
+    assert all(0 < p <= 1 for p in progress)
+    assert progress == sorted(progress) and progress[-1] == pytest.approx(1.0)
+    # XLSX 依列數估算，每批應大致等距，不會一開始就跳到壓縮檔的尾端
+    if name.endswith(".xlsx"):
+        assert progress[0] == pytest.approx(400 / (len(members) + 1), abs=0.01)
+
+# ---------- 解析結果快取與背景工作 ----------
+
+@pytest.fixture
+def clean_cache():
+    profile_cache_clear()
+    yield
+    profile_cache_clear()
+
+def _wait(job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while profile_job_status(job_id)["state"] == "running":
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+    return collect_profile_job(job_id)
+
+def test_shared_cache_keeps_no_member_rows(members, clean_cache):
+    data = members.to_csv(index=False).encode()
+    first = _wait(submit_profile_job(data, "a.csv", 500))
+    assert first["state"] == "done" and not first["cached"]
+    assert len(first["result"]["head"]) == 5
+    cached = profile_cache_get(upload_key(data, "a.csv"))
+    assert "head" not in cached and cached["rows"] == len(members)
+    # 編號、電話欄的最小／最大值也是個別會員的資料，不進共用快取
+    cols = cached["columns"].set_index("欄位")
+    for col in ["member_id", "phone"]:
+        assert pd.isna(cols.loc[col, "最小"]) and pd.isna(cols.loc[col, "最大"])
+    phones = set(members["phone"].dropna())
+    assert not phones & set(cached["columns"][["最小", "平均", "最大"]].stack().tolist())
+    assert cols.loc["age", "最小"] == members["age"].min()
+
+    # 快取命中時從這次上傳的內容補上樣本列，彙總沿用快取
+    second = _wait(submit_profile_job(data, "b.csv", 500))
+    assert second["cached"]
+    pd.testing.assert_frame_equal(second["result"]["head"], first["result"]["head"], check_dtype=False)
+    assert second["result"]["columns"] is cached["columns"]
+
+def test_collected_jobs_are_removed(members, clean_cache):
+    job_id = submit_profile_job(members.head(50).to_csv(index=False).encode(), "c.csv")
+    assert _wait(job_id)["result"]["rows"] == 50
+    assert profile_job_status(job_id) is None and collect_profile_job(job_id) is None
+
+def test_uncollected_jobs_expire(members, clean_cache, monkeypatch):
+    old = submit_profile_job(members.head(10).to_csv(index=False).encode(), "d.csv")
+    while profile_job_status(old)["state"] == "running":
+        time.sleep(0.02)
+    monkeypatch.setattr(shopper_ingest, "SHOPPER_JOB_TTL", 0)
+    _wait(submit_profile_job(members.head(20).to_csv(index=False).encode(), "e.csv"))
+    assert profile_job_status(old) is None
+
+def test_clear_one_upload(members, clean_cache):
+    a = members.head(30).to_csv(index=False).encode()
+    b = members.head(40).to_csv(index=False).encode()
+    _wait(submit_profile_job(a, "a.csv"))
+    _wait(submit_profile_job(b, "b.csv"))
+    profile_cache_clear(upload_key(a, "a.csv"))
+    assert profile_cache_get(upload_key(a, "a.csv")) is None
+    assert profile_cache_get(upload_key(b, "b.csv")) is not None
+    assert profile_cache_stats()["size"] == 1
+
+def test_failed_upload_reports_an_error(clean_cache):
+    job = _wait(submit_profile_job(b"not a workbook", "broken.xlsx"))
+    assert job["state"] == "error" and job["error"]